@@ -0,0 +1,47 @@
+"""
+Recoloring and PNG rendering of map templates (see build_map_template in streamlit_app.py).
+
+Kept in their own module so render worker processes, which are started fresh rather
+than forked from the multithreaded Streamlit server, can import them.
+"""
+import numpy as np
+from io import BytesIO
+
+MAP_DPI = 200  # resolution of rendered PNG maps and of the PDF pages built from them
+
+def update_map_template(template, values, title):
+    """Recolor a map template with one value per unit; unclassed colorbars follow the data range"""
+    values = np.asarray(values, dtype=float)
+
+    if not template['classed'] and np.isfinite(values).any():
+        template['mappable'].set_clim(np.nanmin(values), np.nanmax(values))
+
+    if template['mode'] == "Vector":
+        template['collection'].set_array(np.ma.masked_invalid(values[template['part_index']]))
+    else:
+        # Colour lookup table: one RGBA row per unit plus a transparent row for label -1
+        norm = template['mappable'].norm
+        unit_colors = template['cmap'](norm(np.ma.masked_invalid(values)), bytes=True)
+        lookup = np.vstack([unit_colors, np.zeros((1, 4), dtype=np.uint8)])
+        template['image'].set_data(lookup[template['labels']])
+
+    template['title'].set_text(title)
+    return template['figure']
+
+def render_map_png(fig):
+    """PNG bytes of a map figure, with the same settings st.pyplot uses"""
+    image_buffer = BytesIO()
+    fig.savefig(image_buffer, format='png', dpi=MAP_DPI, bbox_inches='tight', facecolor='white')
+    return image_buffer.getvalue()
+
+# Template of this worker process, received once from the pool initializer
+_worker_template = None
+
+def init_render_worker(template):
+    """Pool initializer: keep the map template for every task of this worker"""
+    global _worker_template
+    _worker_template = template
+
+def render_map_task(values, title):
+    """PNG bytes of one map, drawn on this worker's template"""
+    return render_map_png(update_map_template(_worker_template, values, title))
@@ -2,6 +2,9 @@ import streamlit as st
 import geopandas as gpd
 import rasterio
 import rasterio.mask
+import rasterio.merge
+import rasterio.features
+import rasterio.transform
 import requests
 import tempfile
 import os
@@ -9,11 +12,38 @@ import zipfile
 import math
 import numpy as np
 import pandas as pd
-from io import BytesIO
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+from openpyxl import Workbook
+from io import BytesIO, TextIOWrapper
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+import shapely
+from shapely.geometry import box
+from shapely.strtree import STRtree
 from matplotlib import pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize, BoundaryNorm, ListedColormap
+from matplotlib.ticker import FuncFormatter
+from matplotlib.collections import PatchCollection
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+from matplotlib.animation import FFMpegWriter
+from PIL import Image, GifImagePlugin
+from map_rendering import MAP_DPI, update_map_template, render_map_png, init_render_worker, render_map_task
 from datetime import datetime
+from urllib.parse import quote
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import time
+import hashlib
+import html
+import json
+import sqlite3
+import multiprocessing
+import uuid
+import threading
 
 # Set page config with custom theme
 st.set_page_config(
@@ -185,6 +215,26 @@ st.markdown("""
         box-shadow: 0 6px 20px rgba(96, 165, 250, 0.4);
     }
     
+    /* Download links of prepared files, matching the download buttons */
+    a.export-download {
+        display: block;
+        text-align: center;
+        background: linear-gradient(135deg, #60a5fa 0%, #3b82f6 100%);
+        color: white !important;
+        text-decoration: none;
+        padding: 0.75rem 1.5rem;
+        border-radius: 10px;
+        font-weight: 600;
+        box-shadow: 0 4px 15px rgba(96, 165, 250, 0.3);
+        transition: all 0.3s ease;
+    }
+    
+    a.export-download:hover {
+        background: linear-gradient(135deg, #3b82f6 0%, #2563eb 100%);
+        transform: translateY(-2px);
+        box-shadow: 0 6px 20px rgba(96, 165, 250, 0.4);
+    }
+    
     /* Select boxes and inputs - Dark background with light blue text */
     .stSelectbox > div > div,
     .stMultiSelect > div > div,
@@ -676,6 +726,50 @@ COUNTRY_OPTIONS = {
 # WorldPop country codes (lowercase for URL construction)
 WORLDPOP_CODES = {code: code.lower() for code in COUNTRY_OPTIONS.values()}
 
+# Approximate country extents in WGS84 (min lon, min lat, max lon, max lat)
+# Used to find which WorldPop country rasters an uploaded boundary overlaps
+COUNTRY_BOUNDS = {
+    "AGO": (11.64, -18.04, 24.09, -4.37),
+    "BEN": (0.77, 6.14, 3.85, 12.41),
+    "BWA": (19.99, -26.91, 29.38, -17.78),
+    "BFA": (-5.52, 9.39, 2.41, 15.09),
+    "BDI": (29.00, -4.47, 30.85, -2.31),
+    "CMR": (8.49, 1.65, 16.19, 13.08),
+    "CAF": (14.41, 2.22, 27.46, 11.02),
+    "TCD": (13.47, 7.44, 24.00, 23.45),
+    "COD": (12.20, -13.46, 31.31, 5.39),
+    "GNQ": (5.60, -1.48, 11.34, 3.79),
+    "ETH": (32.99, 3.40, 47.99, 14.89),
+    "GAB": (8.70, -3.98, 14.50, 2.32),
+    "GMB": (-16.84, 13.06, -13.80, 13.83),
+    "GHA": (-3.26, 4.74, 1.20, 11.17),
+    "GIN": (-15.08, 7.19, -7.64, 12.68),
+    "GNB": (-16.72, 10.86, -13.64, 12.69),
+    "CIV": (-8.60, 4.36, -2.49, 10.74),
+    "KEN": (33.91, -4.72, 41.91, 5.03),
+    "LBR": (-11.49, 4.35, -7.37, 8.55),
+    "MDG": (43.22, -25.61, 50.48, -11.95),
+    "MWI": (32.67, -17.13, 35.92, -9.37),
+    "MLI": (-12.24, 10.16, 4.24, 25.00),
+    "MRT": (-17.07, 14.72, -4.83, 27.30),
+    "MOZ": (30.22, -26.87, 40.84, -10.47),
+    "NAM": (11.73, -28.97, 25.26, -16.96),
+    "NER": (0.17, 11.70, 15.99, 23.53),
+    "NGA": (2.67, 4.27, 14.68, 13.89),
+    "COG": (11.20, -5.03, 18.65, 3.71),
+    "RWA": (28.86, -2.84, 30.90, -1.05),
+    "SEN": (-17.54, 12.31, -11.35, 16.69),
+    "SLE": (-13.31, 6.92, -10.27, 10.00),
+    "ZAF": (16.45, -34.84, 32.89, -22.13),
+    "SSD": (23.44, 3.49, 35.95, 12.24),
+    "SDN": (21.81, 8.68, 38.61, 22.23),
+    "TZA": (29.33, -11.76, 40.44, -0.98),
+    "TGO": (-0.15, 6.10, 1.81, 11.14),
+    "UGA": (29.57, -1.48, 35.04, 4.23),
+    "ZMB": (21.99, -18.08, 33.71, -8.22),
+    "ZWE": (25.24, -22.42, 33.06, -15.61)
+}
+
 # Available years for WorldPop data (typically 2000-2020)
 AVAILABLE_YEARS = list(range(2000, 2021))
 
@@ -707,6 +801,78 @@ SEX_OPTIONS = {
     "Female": "f"
 }
 
+# Scenario name used when a single growth rate is projected
+DEFAULT_SCENARIO = "Projection"
+
+# COHORT-COMPONENT PROJECTION ASSUMPTIONS
+# Age groups (WorldPop codes), their widths in years (None = open-ended 80+)
+COHORT_AGE_CODES = [code for code in AGE_GROUPS.values() if code != "ppp"]
+COHORT_AGE_WIDTHS = [1, 4] + [5] * 15 + [None]
+
+# Default annual mortality rates by age group (both sexes, typical sub-Saharan levels)
+COHORT_MORTALITY = [0.050, 0.008, 0.002, 0.0015, 0.002, 0.003, 0.0035, 0.004, 0.005,
+                    0.006, 0.008, 0.011, 0.015, 0.022, 0.033, 0.050, 0.080, 0.150]
+COHORT_MALE_MORTALITY_RATIO = 1.15
+
+# Share of total fertility by mother's age group (sums to 1)
+COHORT_FERTILITY_SHARES = {"15": 0.14, "20": 0.23, "25": 0.22, "30": 0.18, "35": 0.13, "40": 0.07, "45": 0.03}
+SEX_RATIO_AT_BIRTH = 1.03  # males per female
+
+COHORT_SCENARIO = "Cohort-component"
+
+# Map rendering: "Auto" switches to raster rendering above this many polygon parts
+MAP_RENDER_MODES = ["Auto", "Vector", "Raster"]
+RASTER_RENDER_THRESHOLD = 5000
+RASTER_MAP_DPI = 300  # label raster resolution, finer than the rendered maps
+
+# Worker processes for rendering PNG maps
+MAP_RENDER_WORKERS = min(4, os.cpu_count() or 1)
+MAP_CACHE_BYTES = 256 * 1024 * 1024  # rendered PNG maps kept for re-display
+
+# Prepared downloads, written to disk and served by Streamlit from static/
+# (server.enableStaticServing), so a finished file is never read into memory
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "exports")
+EXPORT_URL = "app/static/exports"
+EXPORT_DIR_BYTES = 2 * 1024 ** 3  # prepared files kept on disk, least recently used dropped first
+EXPORT_KEEP_SECONDS = 600  # files used this recently are never dropped
+
+# Map display: one year at a time (rendered on demand) or all years at once
+MAP_DISPLAY_MODES = ["Selected year", "All years"]
+
+# Choropleth classification; classed maps share one set of breaks across all years
+MAP_CLASSIFICATIONS = ["Continuous", "Quantile", "Equal interval", "Natural breaks (Jenks)"]
+JENKS_MAX_BINS = 1000  # natural breaks are optimised over at most this many weighted value bins
+
+# Animated exports of all mapped years
+ANIMATION_FORMATS = ["GIF", "MP4"]
+ANIMATION_DPI = 100  # frame resolution: 1200 x 1000 pixels for the 12 x 10 inch maps
+ANIMATION_FRAME_SECONDS = 1.0
+ANIMATION_GREYS = 32  # palette entries reserved for text, lines and background in GIF frames
+
+# Data downloads: file extension and MIME type per format; the GIS formats have one
+# row per unit (with geometry) and one column per year
+DATA_EXPORT_FORMATS = {"CSV": "csv", "Excel": "xlsx", "GeoParquet": "parquet", "GeoPackage": "gpkg"}
+EXPORT_CHUNK_ROWS = 10000  # records encoded at a time by the CSV and Excel writers
+GEOPARQUET_ROW_GROUP_SIZE = 10000  # units per row group; rows are in Hilbert order, so groups are compact areas
+
+# Opt-in archive of analysis results: Parquet files in hive-style partition folders
+# (country=SLE/admin_level=2/year=2025/analysis_type=total/) and a manifest with one line per run
+RESULTS_ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive")
+ARCHIVE_MANIFEST = "manifest.jsonl"
+ARCHIVE_RECORDS = "records"  # partitioned record files, kept apart from the manifest
+ARCHIVE_PARTITIONING = ds.partitioning(pa.schema([
+    ('country', pa.string()), ('admin_level', pa.string()), ('year', pa.int64()), ('analysis_type', pa.string()),
+]), flavor='hive')
+
+# Historical windows (number of WorldPop years ending at the baseline) for fitted growth rates
+GROWTH_FIT_WINDOWS = {"Last 5 years": 5, "Last 10 years": 10}
+
+# MONTE CARLO UNCERTAINTY
+UNCERTAINTY_PERCENTILES = [5, 50, 95]
+UNCERTAINTY_DRAWS = [1000, 5000, 10000]
+UNCERTAINTY_MEMORY_BUDGET = 256 * 1024 * 1024  # bytes of draws held at once
+UNCERTAINTY_SHARED_VARIANCE = 0.5  # share of the trend uncertainty common to all units
+
 # Initialize session state variables
 if 'data_source' not in st.session_state:
     st.session_state.data_source = "GADM Database"
@@ -953,6 +1119,48 @@ def download_worldpop_data_with_progress(country_code, year, age_group, sex, pro
         
         raise ConnectionError(f"Failed to download WorldPop data for {country_code} {year}: {str(e)}\nTried URL: {url}")
 
+def calculate_zonal_population(gdf, src):
+    """Sum population pixels within each geometry of gdf from an open raster dataset"""
+    # Reproject geodataframe to match raster CRS
+    gdf_reproj = gdf.to_crs(src.crs)
+    
+    total_pop = []
+    mean_density = []
+    valid_pixels_count = []
+    
+    for idx, geom in enumerate(gdf_reproj.geometry):
+        try:
+            masked_data, _ = rasterio.mask.mask(src, [geom], crop=True, nodata=src.nodata)
+            masked_data = masked_data.flatten()
+            
+            # Filter out nodata values
+            if src.nodata is not None:
+                valid_data = masked_data[masked_data != src.nodata]
+            else:
+                valid_data = masked_data
+            valid_data = valid_data[~np.isnan(valid_data)]
+            valid_data = valid_data[valid_data >= 0]  # Remove negative values
+            
+            if len(valid_data) > 0:
+                total_pop.append(np.sum(valid_data))
+                mean_density.append(np.mean(valid_data))
+                valid_pixels_count.append(len(valid_data))
+            else:
+                total_pop.append(0)
+                mean_density.append(0)
+                valid_pixels_count.append(0)
+        except Exception as e:
+            st.warning(f"Error processing geometry {idx}: {str(e)}")
+            total_pop.append(0)
+            mean_density.append(0)
+            valid_pixels_count.append(0)
+    
+    gdf["total_population"] = total_pop
+    gdf["mean_density"] = mean_density
+    gdf["valid_pixels"] = valid_pixels_count
+    
+    return gdf
+
 def process_worldpop_data(_gdf, country_code, year, age_group, sex, progress_callback=None):
     """Process WorldPop population data with improved error handling and smart caching"""
     
@@ -978,62 +1186,177 @@ def process_worldpop_data(_gdf, country_code, year, age_group, sex, progress_cal
 
         try:
             with rasterio.open(tif_file_path) as src:
-                # Reproject geodataframe to match raster CRS
-                gdf_reproj = gdf.to_crs(src.crs)
-                
-                total_pop = []
-                mean_density = []
-                valid_pixels_count = []
-                
-                for idx, geom in enumerate(gdf_reproj.geometry):
-                    try:
-                        masked_data, _ = rasterio.mask.mask(src, [geom], crop=True, nodata=src.nodata)
-                        masked_data = masked_data.flatten()
-                        
-                        # Filter out nodata values
-                        if src.nodata is not None:
-                            valid_data = masked_data[masked_data != src.nodata]
-                        else:
-                            valid_data = masked_data
-                        valid_data = valid_data[~np.isnan(valid_data)]
-                        valid_data = valid_data[valid_data >= 0]  # Remove negative values
-                        
-                        if len(valid_data) > 0:
-                            total_pop.append(np.sum(valid_data))
-                            mean_density.append(np.mean(valid_data))
-                            valid_pixels_count.append(len(valid_data))
-                        else:
-                            total_pop.append(0)
-                            mean_density.append(0)
-                            valid_pixels_count.append(0)
-                    except Exception as e:
-                        st.warning(f"Error processing geometry {idx}: {str(e)}")
-                        total_pop.append(0)
-                        mean_density.append(0)
-                        valid_pixels_count.append(0)
-
-                gdf["total_population"] = total_pop
-                gdf["mean_density"] = mean_density
-                gdf["valid_pixels"] = valid_pixels_count
+                gdf = calculate_zonal_population(gdf, src)
                 
         except rasterio.errors.RasterioIOError as e:
             raise ValueError(f"Failed to process raster file: {str(e)}")
     
     return gdf, used_url, file_size
 
+@st.cache_resource
+def build_country_bounds_index():
+    """Build an STRtree spatial index over the COUNTRY_BOUNDS extents"""
+    codes = list(COUNTRY_BOUNDS.keys())
+    boxes = [box(*COUNTRY_BOUNDS[code]) for code in codes]
+    return codes, boxes, STRtree(boxes)
+
+def match_worldpop_countries(gdf):
+    """
+    Find the WorldPop countries whose extents intersect the given boundaries.
+    
+    Returns a list of (country_code, bounds) tuples ordered by overlap area (largest first),
+    where bounds is the WGS84 extent of the boundaries inside that country's extent.
+    """
+    gdf_wgs84 = gdf.to_crs("EPSG:4326")
+    geoms = gdf_wgs84.geometry.values
+    geoms = geoms[~(shapely.is_missing(geoms) | shapely.is_empty(geoms))]
+    if len(geoms) == 0:
+        return []
+    
+    codes, boxes, tree = build_country_bounds_index()
+    
+    # Candidate countries from the index, refined against the actual geometry
+    _, box_idx = tree.query(geoms, predicate="intersects")
+    union_geom = shapely.union_all(geoms)
+    
+    matches = []
+    for i in np.unique(box_idx):
+        overlap = shapely.intersection(union_geom, boxes[i])
+        if overlap.is_empty:
+            continue
+        matches.append((overlap.area, codes[i], overlap.bounds))
+    
+    matches.sort(key=lambda match: match[0], reverse=True)
+    return [(code, bounds) for _, code, bounds in matches]
+
+def construct_worldpop_urls(country_code, year, age_group, sex):
+    """Return the primary WorldPop URL followed by fallback URLs to try"""
+    urls = [construct_worldpop_url(country_code, year, age_group, sex)]
+    if age_group == "ppp":
+        country_lower = WORLDPOP_CODES[country_code]
+        urls.append(f"https://data.worldpop.org/GIS/Population/Global_2000_2020/{year}/{country_code.upper()}/{country_lower}_ppp_{year}.tif")
+    return urls
+
+@st.cache_data
+def read_worldpop_window(country_code, year, age_group, sex, bounds):
+    """
+    Read only the part of a WorldPop raster that covers bounds (WGS84).
+    
+    Uses HTTP range requests so only the rows/tiles inside the window are fetched.
+    Returns (array, transform, crs, nodata, url), or None if the window has no valid population.
+    """
+    last_error = None
+    
+    for url in construct_worldpop_urls(country_code, year, age_group, sex):
+        try:
+            with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"):
+                with rasterio.open(f"/vsicurl/{url}") as src:
+                    # Pixel window covering the bounds, clipped to the raster
+                    fwin = rasterio.windows.from_bounds(*bounds, transform=src.transform)
+                    col_start = max(int(math.floor(fwin.col_off)), 0)
+                    row_start = max(int(math.floor(fwin.row_off)), 0)
+                    col_stop = min(int(math.ceil(fwin.col_off + fwin.width)), src.width)
+                    row_stop = min(int(math.ceil(fwin.row_off + fwin.height)), src.height)
+                    
+                    if col_stop <= col_start or row_stop <= row_start:
+                        return None
+                    
+                    window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+                    data = src.read(1, window=window)
+                    
+                    valid = ~np.isnan(data) & (data > 0)
+                    if src.nodata is not None:
+                        valid &= data != src.nodata
+                    if not valid.any():
+                        return None
+                    
+                    return data, src.window_transform(window), src.crs, src.nodata, url
+        except rasterio.errors.RasterioIOError as e:
+            last_error = e
+            continue
+    
+    raise ConnectionError(f"Failed to read WorldPop data for {country_code} {year}: {str(last_error)}")
+
+def process_worldpop_mosaic(_gdf, country_matches, year, age_group, sex, progress_callback=None):
+    """
+    Process WorldPop data for boundaries that may span several countries.
+    
+    Only the window of each matched country raster that intersects the boundaries is
+    fetched; the windows are mosaicked and zonal statistics run on the mosaic.
+    """
+    gdf = _gdf.copy()
+    
+    windows = []
+    used_urls = []
+    used_countries = []
+    
+    for i, (code, bounds) in enumerate(country_matches):
+        window_data = read_worldpop_window(code, year, age_group, sex, tuple(bounds))
+        if window_data is not None:
+            windows.append(window_data)
+            used_urls.append(window_data[4])
+            used_countries.append(code)
+        if progress_callback:
+            progress_callback(i + 1, len(country_matches), code)
+    
+    if not windows:
+        raise ValueError("No WorldPop population found within the uploaded boundaries")
+    
+    nodata = next((w[3] for w in windows if w[3] is not None), -99999.0)
+    
+    memfiles = []
+    datasets = []
+    try:
+        for data, transform, crs, _, _ in windows:
+            memfile = MemoryFile()
+            dataset = memfile.open(
+                driver="GTiff", height=data.shape[0], width=data.shape[1], count=1,
+                dtype=data.dtype, crs=crs, transform=transform, nodata=nodata
+            )
+            dataset.write(data, 1)
+            memfiles.append(memfile)
+            datasets.append(dataset)
+        
+        mosaic, mosaic_transform = rasterio.merge.merge(datasets, nodata=nodata)
+        mosaic_crs = datasets[0].crs
+    finally:
+        for dataset in datasets:
+            dataset.close()
+        for memfile in memfiles:
+            memfile.close()
+    
+    with MemoryFile() as memfile:
+        with memfile.open(
+            driver="GTiff", height=mosaic.shape[1], width=mosaic.shape[2], count=1,
+            dtype=mosaic.dtype, crs=mosaic_crs, transform=mosaic_transform, nodata=nodata
+        ) as src:
+            src.write(mosaic)
+            gdf = calculate_zonal_population(gdf, src)
+    
+    total_size = sum(w[0].nbytes for w in windows)
+    
+    return gdf, used_urls, used_countries, total_size
+
 def project_population(base_gdf, base_year, growth_rate, num_years):
     """
     Project population for multiple years using compound growth formula.
     Uses the selected base year and projects forward.
     
+    All scenarios, units and years are computed in one broadcasted operation; geometry
+    is not copied (use year_frame to join a year's values back onto the boundaries).
+    
     Parameters:
     - base_gdf: GeoDataFrame with base year population data
     - base_year: The baseline year (e.g., 2015, 2020)
-    - growth_rate: Annual growth rate as percentage (e.g., 2.5 for 2.5%, -1.5 for -1.5%)
+    - growth_rate: Annual growth rate as percentage (e.g., 2.5 for 2.5%, -1.5 for -1.5%).
+      Either a single national rate, an array with one rate per unit, or a dictionary of
+      scenario name -> rate (national or per-unit) to project several scenarios at once
     - num_years: Number of years to project from base year (e.g., 5 means base_year+1 to base_year+5)
     
     Returns:
-    - Dictionary with years as keys and projected GeoDataFrames as values
+    - Dictionary with 'years' (list of projected years), 'scenarios' (list of scenario
+      names), 'growth_rates' (scenarios × units array of rates used) and, for
+      'total_population' and 'mean_density', an array of shape (scenarios, units, years)
     
     Example:
     - base_gdf has 2015 population = 100,000
@@ -1045,189 +1368,1739 @@ def project_population(base_gdf, base_year, growth_rate, num_years):
     - If growth_rate = -1.5% (negative/decline)
     - Returns: {2016: 98,500, 2017: 97,023, ..., 2020: 92,774}
     """
-    projected_data = {}
+    num_units = len(base_gdf)
+    
+    if not isinstance(growth_rate, dict):
+        growth_rate = {DEFAULT_SCENARIO: growth_rate}
     
-    # Calculate growth factor (works for both positive and negative rates)
-    growth_factor = 1 + (growth_rate / 100)
+    scenarios = list(growth_rate.keys())
+    
+    # Scenarios × units matrix of annual rates (national rates broadcast to every unit)
+    rates = np.stack([
+        np.broadcast_to(np.asarray(growth_rate[scenario], dtype=float), (num_units,))
+        for scenario in scenarios
+    ])
     
     # Always project forward from base year
     # Year (base+1) = base + 1 year, Year (base+2) = base + 2 years, etc.
     years = list(range(base_year + 1, base_year + 1 + num_years))
     
-    for year_idx, proj_year in enumerate(years):
-        # Create a copy of the base geodataframe
-        projected_gdf = base_gdf.copy()
-        
-        # Years from base year: 1, 2, 3, 4, 5, ...
-        years_from_base = year_idx + 1
+    # Compound growth factors (1 + r)^t for t = 1..num_years, computed once per distinct rate
+    unique_rates, rate_index = np.unique(rates, return_inverse=True)
+    factor_table = np.array([
+        [(1 + (rate / 100)) ** years_from_base for years_from_base in range(1, num_years + 1)]
+        for rate in unique_rates
+    ]).reshape(len(unique_rates), num_years)
+    growth_factors = factor_table[rate_index.reshape(rates.shape)]
+    
+    projected_data = {'years': years, 'scenarios': scenarios, 'growth_rates': rates,
+                      'columns': ['total_population', 'mean_density']}
+    
+    for column in projected_data['columns']:
+        base_values = base_gdf[column].to_numpy()
+        # Keep the column's float precision, as the per-year Series arithmetic did
+        factors = growth_factors.astype(np.result_type(base_values.dtype, np.float32))
         
-        # Apply compound growth formula: P(year) = P(base) * (1 + r)^t
-        # Where t = years from base year
-        # For positive growth: population increases
-        # For negative growth: population decreases
-        projected_gdf['total_population'] = base_gdf['total_population'] * (growth_factor ** years_from_base)
-        projected_gdf['mean_density'] = base_gdf['mean_density'] * (growth_factor ** years_from_base)
-        
-        projected_data[proj_year] = projected_gdf
+        # P(year) = P(base) * (1 + r)^t for every scenario, unit and year at once
+        projected_data[column] = base_values[np.newaxis, :, np.newaxis] * factors
     
     return projected_data
 
-# Main app layout with custom header
-st.markdown("""
-<h1>
-    WorldPop Population Data Analysis
-</h1>
-<p style='text-align: center; color: #9ca3af; font-size: 1.2rem; margin-top: -1rem; margin-bottom: 2rem;'>
-    Analyze population distribution for public health planning and intervention targeting
-</p>
-""", unsafe_allow_html=True)
+def band_columns(column='total_population'):
+    """Names of the percentile band columns for a projected column"""
+    return [f"{column}_p{percentile}" for percentile in UNCERTAINTY_PERCENTILES]
 
-# Sidebar for controls
-with st.sidebar:
-    st.markdown("## Analysis Parameters")
+def simulate_projection_bands(base_values, growth_rates, num_years, rate_sd, annual_sd, num_draws,
+                              memory_budget=UNCERTAINTY_MEMORY_BUDGET, seed=0):
+    """
+    Monte Carlo percentile bands for compound growth projections.
     
-    # Data source selection
-    data_source = st.radio(
-        "Select Data Source", 
-        ["GADM Database", "Upload Custom Shapefile"],
-        help="Choose between official GADM boundaries or upload your own shapefile"
-    )
-    st.session_state.data_source = data_source
+    Each draw perturbs every unit's trend rate by rate_sd (part of it shared by all
+    units, see UNCERTAINTY_SHARED_VARIANCE) and adds independent year-to-year noise of
+    annual_sd. Units are simulated in chunks so that draws × chunk units × years stays
+    within memory_budget; the national total is accumulated draw by draw across chunks.
     
-    if data_source == "GADM Database":
-        # Country and admin level selection
-        country = st.selectbox("Select Country", list(COUNTRY_OPTIONS.keys()), 
-                              help="Select any African country")
-        admin_level = st.selectbox("Administrative Level", [0, 1, 2, 3, 4], 
-                                  help="0=Country, 1=Regions, 2=Districts, 3=Communes, 4=Localities")
+    Parameters:
+    - base_values: baseline population per unit
+    - growth_rates: annual growth rate per unit (%)
+    - num_years: number of projected years
+    - rate_sd, annual_sd: standard deviations of the trend and annual rates (% points)
+    - num_draws: number of Monte Carlo draws
+    
+    Returns:
+    - (unit_bands, total_bands): arrays of shape (percentiles, units, years) and
+      (percentiles, years) for UNCERTAINTY_PERCENTILES
+    """
+    rng = np.random.default_rng(seed)
+    num_units = len(base_values)
+    base_values = np.asarray(base_values, dtype=np.float32)
+    growth_rates = np.asarray(growth_rates, dtype=np.float32)
+    
+    # Linear-interpolation percentiles from one partial sort of the draw axis
+    positions = np.asarray(UNCERTAINTY_PERCENTILES) / 100 * (num_draws - 1)
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, num_draws - 1)
+    weight = positions - lower
+    
+    # float32 draws laid out chunk units × years × draws, so the partial sort runs on contiguous
+    # rows; allow for one temporary copy of the chunk on top of the draws themselves
+    chunk_size = max(1, int(memory_budget // (2 * 4 * num_draws * num_years)))
+    
+    shared = rng.standard_normal(num_draws, dtype=np.float32) * np.float32(rate_sd * np.sqrt(UNCERTAINTY_SHARED_VARIANCE))
+    unit_sd = np.float32(rate_sd * np.sqrt(1 - UNCERTAINTY_SHARED_VARIANCE))
+    
+    unit_bands = np.empty((len(UNCERTAINTY_PERCENTILES), num_units, num_years))
+    totals = np.zeros((num_years, num_draws))
+    
+    for start in range(0, num_units, chunk_size):
+        stop = min(start + chunk_size, num_units)
         
-        # Show admin level description
-        level_descriptions = {
-            0: "Country boundary",
-            1: "First-level admin (regions/states)",
-            2: "Second-level admin (districts/provinces)", 
-            3: "Third-level admin (communes/counties)",
-            4: "Fourth-level admin (localities/wards)"
-        }
-        st.caption(f"Level {admin_level}: {level_descriptions.get(admin_level, 'Administrative division')}")
+        # Trend rate of each unit and draw, then annual rates around it (all in place)
+        trend = rng.standard_normal((stop - start, num_draws), dtype=np.float32)
+        trend *= unit_sd
+        trend += shared[np.newaxis, :]
+        trend += growth_rates[start:stop, np.newaxis]
         
-        # Set variables for GADM mode
-        country_code = COUNTRY_OPTIONS[country]
-        use_custom_shapefile = False
+        draws = rng.standard_normal((stop - start, num_years, num_draws), dtype=np.float32)
+        draws *= np.float32(annual_sd)
+        draws += trend[:, np.newaxis, :]
+        draws /= 100
+        draws += 1
+        np.cumprod(draws, axis=1, out=draws)
+        draws *= base_values[start:stop, np.newaxis, np.newaxis]
         
-        # Update session state
-        st.session_state.country = country
-        st.session_state.country_code = country_code
-        st.session_state.admin_level = admin_level
-        st.session_state.use_custom_shapefile = False
+        totals += draws.sum(axis=0)
         
-    else:  # Upload Custom Shapefile
-        st.markdown("**Upload Shapefile Components**")
-        st.caption("Upload all required files for your shapefile")
+        draws.partition(np.union1d(lower, upper), axis=2)
+        unit_bands[:, start:stop] = np.moveaxis(
+            draws[:, :, lower] * (1 - weight) + draws[:, :, upper] * weight, 2, 0
+        )
+    
+    return unit_bands, np.percentile(totals, UNCERTAINTY_PERCENTILES, axis=1)
+
+def add_uncertainty_bands(projected_data, base_gdf, rate_sd, annual_sd, num_draws, progress_callback=None):
+    """
+    Add Monte Carlo percentile bands of total_population to a project_population result.
+    
+    Adds one (scenarios, units, years) array per band column (see band_columns) and
+    'total_population_bands', the (scenarios, percentiles, years) bands of the total.
+    """
+    base_values = base_gdf['total_population'].to_numpy(dtype=float)
+    num_years = len(projected_data['years'])
+    columns = band_columns()
+    
+    bands = {column: [] for column in columns}
+    total_bands = []
+    
+    for i, rates in enumerate(projected_data['growth_rates']):
+        unit_bands, scenario_total_bands = simulate_projection_bands(
+            base_values, rates, num_years, rate_sd, annual_sd, num_draws, seed=i
+        )
+        for column, band in zip(columns, unit_bands):
+            bands[column].append(band)
+        total_bands.append(scenario_total_bands)
+        if progress_callback:
+            progress_callback(i + 1, len(projected_data['growth_rates']))
+    
+    for column in columns:
+        projected_data[column] = np.stack(bands[column])
+    projected_data['columns'] = projected_data['columns'] + columns
+    projected_data['total_population_bands'] = np.stack(total_bands)
+    
+    return projected_data
+
+def build_population_matrix(base_gdf, base_year, projected_data=None, base_cohorts=None):
+    """
+    Stack baseline and projected values into one scenarios × units × years array per column.
+    
+    Returns a dictionary with 'years' (baseline first), 'scenarios', 'columns' and, for
+    each column, an array of shape (scenarios, units, years). Baseline values are taken
+    from the same-named base_gdf columns. For cohort-component projections, the baseline
+    cohorts (units × cohorts) are stacked with the projected ones into 'cohorts'.
+    """
+    scenarios = projected_data['scenarios'] if projected_data else [DEFAULT_SCENARIO]
+    columns = projected_data['columns'] if projected_data else ['total_population', 'mean_density']
+    population = {'years': [base_year], 'scenarios': scenarios, 'columns': columns}
+    
+    for column in columns:
+        base_values = base_gdf[column].to_numpy()[np.newaxis, :, np.newaxis]
+        population[column] = np.repeat(base_values, len(scenarios), axis=0)
+    
+    if projected_data:
+        population['years'] = population['years'] + projected_data['years']
+        population['growth_rates'] = projected_data['growth_rates']
+        for column in columns:
+            population[column] = np.concatenate([population[column], projected_data[column]], axis=2)
         
-        # File uploaders - Required files
-        shp_file = st.file_uploader("Shapefile (.shp)", type=['shp'], help="Main geometry file (required)")
-        shx_file = st.file_uploader("Shape Index (.shx)", type=['shx'], help="Spatial index file (required)")
-        dbf_file = st.file_uploader("Attribute Table (.dbf)", type=['dbf'], help="Attribute data file (required)")
+        if 'cohorts' in projected_data and base_cohorts is not None:
+            base_states = np.broadcast_to(base_cohorts[np.newaxis, :, :, np.newaxis],
+                                          projected_data['cohorts'].shape[:3] + (1,))
+            population['cohorts'] = np.concatenate([base_states, projected_data['cohorts']], axis=3)
+    
+    return population
+
+def cohort_column_name(sex, age_group):
+    """Control table column holding the national total of an age/sex cohort (e.g. 'f_15')"""
+    return f"{sex}_{age_group}"
+
+def read_control_totals(control_table, year_column, total_column):
+    """
+    National control totals from an uploaded year → total table.
+    
+    Returns:
+    - (totals, margins): dictionaries year -> national total and, when the table has a
+      column for every age/sex cohort (see cohort_column_name), year -> array of cohort
+      totals in cohort_index order (empty otherwise)
+    """
+    table = control_table.dropna(subset=[year_column, total_column])
+    years = table[year_column].astype(int).to_numpy()
+    totals = dict(zip(years, table[total_column].astype(float).to_numpy()))
+    
+    cohort_columns = [None] * (len(SEX_OPTIONS) * len(COHORT_AGE_CODES))
+    for sex in SEX_OPTIONS.values():
+        for age_group in COHORT_AGE_CODES:
+            cohort_columns[cohort_index(sex, age_group)] = cohort_column_name(sex, age_group)
+    
+    margins = {}
+    if all(column in table.columns for column in cohort_columns):
+        margin_values = table[cohort_columns].astype(float).to_numpy()
+        margins = {y: values for y, values in zip(years, margin_values) if np.all(np.isfinite(values))}
+    
+    return totals, margins
+
+def rake_to_control_totals(population, control_totals, cohort_margins=None, target_cohort=None,
+                           max_iterations=100, tolerance=1e-6):
+    """
+    Calibrate projected units to national control totals.
+    
+    Every scenario and year with a control total is scaled in one broadcasted pass so
+    that its units sum to the control total. When population carries 'cohorts' and
+    cohort_margins are given, the cohorts of those years are then fitted by iterative
+    proportional fitting (all years at once) to the raked unit totals and the national
+    age/sex margins, and the derived columns are recomputed from the fitted cohorts.
+    
+    Parameters:
+    - population: output of build_population_matrix (modified in place)
+    - control_totals: dictionary year -> national total; without cohort margins this must
+      be the national total of the analysed population itself (e.g. of the analysed cohort)
+    - cohort_margins: optional dictionary year -> national total per cohort
+    - target_cohort: cohort index analysed as total_population (None = all cohorts)
+    
+    Returns:
+    - population, with 'raking_factors' (scenarios × years; 1 where no control total)
+    """
+    years = population['years']
+    targets = np.array([control_totals.get(y, np.nan) for y in years], dtype=float)
+    
+    if cohort_margins and 'cohorts' in population:
+        # Rake the whole population, then fit cohorts to unit totals and age/sex margins
+        # (in float64, so raked totals meet the control totals beyond float32 rounding)
+        cohorts = population['cohorts'].astype(float)
+        unit_totals = cohorts.sum(axis=2)
+        totals = unit_totals.sum(axis=1)
+        factors = np.where(np.isfinite(targets) & (totals > 0), targets / np.where(totals > 0, totals, 1), 1.0)
+        unit_totals = unit_totals * factors[:, np.newaxis, :]
         
-        # Optional projection file
-        prj_file = st.file_uploader("Projection File (.prj)", type=['prj'], 
-                                   help="Coordinate system definition (optional but recommended)")
+        margin_years = [i for i, y in enumerate(years) if y in cohort_margins and np.isfinite(targets[i])]
+        fitted = cohorts * factors[:, np.newaxis, np.newaxis, :]
         
-        # Check if required files are uploaded
-        if shp_file and shx_file and dbf_file:
-            st.success("Required files uploaded successfully!")
-            use_custom_shapefile = True
+        if margin_years:
+            # Margins are rescaled to the control total so both sets of margins agree
+            margins = np.stack([cohort_margins[years[i]] for i in margin_years], axis=1)
+            margins = margins * targets[margin_years] / np.maximum(margins.sum(axis=0), 1e-12)
             
-            # Show file details
-            with st.expander("File Details"):
-                st.write(f"**SHP file**: {shp_file.name} ({shp_file.size:,} bytes)")
-                st.write(f"**SHX file**: {shx_file.name} ({shx_file.size:,} bytes)")
-                st.write(f"**DBF file**: {dbf_file.name} ({dbf_file.size:,} bytes)")
-                if prj_file:
-                    st.write(f"**PRJ file**: {prj_file.name} ({prj_file.size:,} bytes)")
-                    st.success("Projection file included - coordinate system will be automatically detected!")
-                else:
-                    st.warning("No projection file - will assume WGS84 coordinate system")
-        else:
-            use_custom_shapefile = False
-            st.info("Please upload .shp, .shx, and .dbf files to proceed")
+            cells = fitted[:, :, :, margin_years]
+            rows = unit_totals[:, :, np.newaxis, margin_years]
+            columns = margins[np.newaxis, np.newaxis]
             
-            # Show upload requirements
-            with st.expander("Shapefile Upload Requirements"):
-                st.markdown("""
-                **Required Files:**
-                - **.shp**: Contains the geometry data
-                - **.shx**: Spatial index for quick access
-                - **.dbf**: Attribute table with feature data
-                
-                **Optional Files:**
-                - **.prj**: Coordinate system definition (highly recommended)
+            for _ in range(max_iterations):
+                row_sums = cells.sum(axis=2, keepdims=True)
+                cells *= np.divide(rows, row_sums, out=np.ones_like(row_sums), where=row_sums > 0)
+                column_sums = cells.sum(axis=1, keepdims=True)
+                cells *= np.divide(columns, column_sums, out=np.ones_like(column_sums), where=column_sums > 0)
                 
-                **Important Notes:**
-                - All files must have the same base name
-                - Maximum file size: 200MB per file
-                - If no .prj file is provided, WGS84 coordinate system will be assumed
-                - Including a .prj file prevents coordinate system errors
-                - Ensure your shapefile contains administrative boundaries or areas of interest
-                """)
+                row_error = np.abs(cells.sum(axis=2, keepdims=True) - rows)
+                if np.all(row_error <= tolerance * np.maximum(rows, 1)):
+                    break
+            
+            fitted[:, :, :, margin_years] = cells
         
-        # Set variables for custom mode
-        country = "Custom Area"
-        country_code = "CUSTOM"
-        admin_level = "Custom"
+        # Derived columns follow the fitted cohorts; density scales with the analysed population
+        previous = population['total_population']
+        if target_cohort is None:
+            population['total_population'] = fitted.sum(axis=2)
+        else:
+            population['total_population'] = fitted[:, :, target_cohort, :]
         
-        # Update session state
-        st.session_state.country = country
-        st.session_state.country_code = country_code
-        st.session_state.admin_level = admin_level
-        st.session_state.use_custom_shapefile = use_custom_shapefile
+        ratio = np.divide(population['total_population'], previous,
+                          out=np.ones_like(previous, dtype=float), where=previous > 0)
+        population['mean_density'] = population['mean_density'] * ratio
+        population['under5_population'] = fitted[:, :, COHORT_UNDER5, :].sum(axis=2)
+        population['wra_population'] = fitted[:, :, COHORT_WRA, :].sum(axis=2)
+        population['cohorts'] = fitted
+        population['raking_factors'] = np.divide(population['total_population'].sum(axis=1), previous.sum(axis=1),
+                                                 out=np.ones(previous.shape[::2]), where=previous.sum(axis=1) > 0)
+        return population
+    
+    totals = population['total_population'].sum(axis=1, dtype=float)
+    factors = np.where(np.isfinite(targets) & (totals > 0), targets / np.where(totals > 0, totals, 1), 1.0)
+    
+    # Every column is a population count (or density) and scales with the total, as do the
+    # cohorts they are derived from; scaled in float64 so the totals meet the control totals
+    for column in population['columns']:
+        population[column] = population[column].astype(float) * factors[:, np.newaxis, :]
+    if 'cohorts' in population:
+        population['cohorts'] = population['cohorts'].astype(float) * factors[:, np.newaxis, np.newaxis, :]
+    population['raking_factors'] = factors
+    
+    return population
 
-    st.markdown("---")
+def load_uploaded_table(uploaded_file):
+    """Load an uploaded CSV or Excel table (growth rates, control totals)"""
+    file_extension = uploaded_file.name.split('.')[-1].lower()
+    
+    if file_extension == 'csv':
+        return pd.read_csv(uploaded_file)
+    elif file_extension in ['xlsx', 'xls']:
+        return pd.read_excel(uploaded_file)
+    raise ValueError("Unsupported file format. Please upload CSV or Excel file.")
+
+def match_growth_rates(base_gdf, rate_table, key_column, rate_columns, default_rate):
+    """
+    Align a per-unit growth rate table with the boundary units.
     
-    # Year selection and projection
-    st.markdown("### Year Selection & Analysis")
+    The boundary attribute whose values best match the table's key column is used for
+    the join. Units without a match get default_rate.
     
-    # Multi-year projection toggle FIRST
-    enable_projection = st.checkbox("Enable Multi-Year Projection", value=False,
-                                   help="Project population forward from 2020 baseline using growth rate")
+    Returns (dict of scenario name -> per-unit rate array, matched attribute, unmatched count).
+    """
+    table_keys = rate_table[key_column].astype(str).str.strip().str.lower()
     
-    # FIXED IF-ELSE LOGIC
-    if enable_projection:
-        # Automatically use 2020 as baseline for projections
-        year = 2020
-        st.info("📊 **2020 automatically selected as baseline** for multi-year projections (most recent WorldPop data)")
-        
-        col_proj1, col_proj2 = st.columns(2)
-        
-        with col_proj1:
-            projection_years = st.number_input(
-                "Number of Years to Project",
-                min_value=1,
-                max_value=20,
-                value=5,
-                step=1,
-                help="Number of years forward from 2020 (e.g., 5 = years 2021-2025)"
-            )
-        
-        with col_proj2:
-            growth_rate = st.number_input(
-                "Annual Growth Rate (%)",
-                min_value=-10.0,
-                max_value=10.0,
-                value=2.5,
-                step=0.1,
-                format="%.2f",
-                help="Annual population growth rate from 2020 baseline (positive = growth, negative = decline)"
-            )
+    # Pick the boundary attribute that shares the most values with the key column
+    best_column, best_matches = None, 0
+    for column in base_gdf.columns:
+        if column == 'geometry':
+            continue
+        unit_keys = base_gdf[column].astype(str).str.strip().str.lower()
+        matches = unit_keys.isin(table_keys).sum()
+        if matches > best_matches:
+            best_column, best_matches = column, matches
+    
+    if best_column is None:
+        raise ValueError(f"No boundary attribute matches the values in '{key_column}'")
+    
+    unit_keys = base_gdf[best_column].astype(str).str.strip().str.lower()
+    lookup = rate_table.assign(_key=table_keys).drop_duplicates('_key').set_index('_key')
+    
+    rates = {}
+    for rate_column in rate_columns:
+        unit_rates = unit_keys.map(lookup[rate_column]).astype(float)
+        rates[rate_column] = unit_rates.fillna(default_rate).to_numpy()
+    
+    unmatched = int((~unit_keys.isin(lookup.index)).sum())
+    
+    return rates, best_column, unmatched
+
+def describe_growth_rates(growth_rate, rate_columns, scenario_rates, fit_years=None):
+    """Describe the growth rate settings for metadata"""
+    if fit_years:
+        return f"Fitted per unit from WorldPop {fit_years[0]}-{fit_years[-1]}; {growth_rate}% for units without a fit"
+    if rate_columns:
+        return f"Per-unit table ({', '.join(rate_columns)}); {growth_rate}% for unmatched units"
+    if scenario_rates:
+        return ', '.join(f"{name}: {rate}%" for name, rate in scenario_rates.items())
+    return f"{growth_rate}%"
+
+def fetch_zonal_population(gdf, worldpop_source, year, age_group, sex, progress_callback=None):
+    """
+    Zonal population for gdf from either a single country raster (GADM boundaries,
+    worldpop_source is a country code) or a mosaic of matched countries (custom
+    boundaries, worldpop_source is the output of match_worldpop_countries).
+    """
+    if isinstance(worldpop_source, str):
+        processed_gdf, _, _ = process_worldpop_data(gdf, worldpop_source, year, age_group, sex, progress_callback)
+    else:
+        processed_gdf, _, _, _ = process_worldpop_mosaic(gdf, worldpop_source, year, age_group, sex)
+    return processed_gdf
+
+def boundary_cache_key(gdf):
+    """Stable key for a set of boundaries, used to cache zonal results computed on them"""
+    digest = hashlib.sha1()
+    for geometry_wkb in shapely.to_wkb(gdf.geometry.to_numpy()):
+        digest.update(geometry_wkb)
+    return digest.hexdigest()
+
+def estimate_growth_rates(history, years):
+    """
+    Fit log-linear growth, log P(t) = a + b·t, to each unit's population history.
+    
+    All units are fitted in one least-squares solve (one right-hand side per unit).
+    Units with a zero or missing total in any year are not fitted and get NaN.
+    
+    Parameters:
+    - history: units × years array of zonal totals
+    - years: the years of the history columns
+    
+    Returns:
+    - Array of annual growth rates in percent, one per unit
+    """
+    t = np.asarray(years, dtype=float) - years[-1]
+    design = np.column_stack([np.ones_like(t), t])
+    
+    fitted = np.all(np.isfinite(history) & (history > 0), axis=1)
+    rates = np.full(history.shape[0], np.nan)
+    
+    if fitted.any():
+        coefficients, _, _, _ = np.linalg.lstsq(design, np.log(history[fitted]).T, rcond=None)
+        rates[fitted] = np.expm1(coefficients[1]) * 100
+    
+    return rates
+
+@st.cache_data(show_spinner=False)
+def zonal_population_history(_gdf, boundary_key, worldpop_source, year, age_group, sex):
+    """
+    Zonal totals of one WorldPop year for gdf, cached on boundary_key (see
+    boundary_cache_key). Pure data: no progress is reported from inside the cache.
+    """
+    year_gdf = fetch_zonal_population(_gdf, worldpop_source, year, age_group, sex)
+    return year_gdf['total_population'].to_numpy(dtype=float)
+
+def fit_historical_growth(gdf, boundary_key, worldpop_source, end_year, num_years, age_group, sex,
+                          progress_callback=None):
+    """
+    Per-unit growth rates fitted to the num_years WorldPop years ending at end_year.
+    
+    Each year's zonal totals are cached (zonal_population_history), so projecting again
+    with fitted rates is instant; progress is reported here, outside the cache.
+    
+    Returns:
+    - (years, history, rates): the fitted years, the units × years zonal totals and the
+      fitted annual rate in percent per unit (NaN where no fit was possible)
+    """
+    years = [y for y in range(end_year - num_years + 1, end_year + 1) if y in AVAILABLE_YEARS]
+    history = np.empty((len(gdf), len(years)))
+    
+    for i, hist_year in enumerate(years):
+        if progress_callback:
+            progress_callback(i + 1, len(years), hist_year)
+        history[:, i] = zonal_population_history(gdf, boundary_key, worldpop_source, hist_year, age_group, sex)
+    
+    return years, history, estimate_growth_rates(history, years)
+
+def cohort_index(sex, age_group):
+    """Position of an age/sex cohort in the cohort axis (males first, then females)"""
+    return list(SEX_OPTIONS.values()).index(sex) * len(COHORT_AGE_CODES) + COHORT_AGE_CODES.index(age_group)
+
+# Cohort positions used for the derived under-5 and women of reproductive age (15-49) totals
+COHORT_UNDER5 = [cohort_index(sex, age) for sex in SEX_OPTIONS.values() for age in ["0", "1"]]
+COHORT_WRA = [cohort_index("f", age) for age in COHORT_FERTILITY_SHARES]
+
+def process_age_sex_cohorts(gdf, worldpop_source, year, progress_callback=None):
+    """Zonal totals of every AGE_GROUPS × SEX_OPTIONS layer, as a units × cohorts array"""
+    cohorts = np.zeros((len(gdf), len(SEX_OPTIONS) * len(COHORT_AGE_CODES)))
+    
+    layer = 0
+    for sex in SEX_OPTIONS.values():
+        for age_group in COHORT_AGE_CODES:
+            layer_gdf = fetch_zonal_population(gdf, worldpop_source, year, age_group, sex)
+            cohorts[:, cohort_index(sex, age_group)] = layer_gdf['total_population'].to_numpy(dtype=float)
+            
+            layer += 1
+            if progress_callback:
+                progress_callback(layer, cohorts.shape[1], age_group, sex)
+    
+    return cohorts
+
+def baseline_cohorts(base_gdf, cohorts, age_group="ppp"):
+    """
+    Starting cohorts for a cohort-component projection.
+    
+    For total population the age/sex layers only supply each unit's structure, which is
+    rescaled to the unit's baseline total (national structure where a unit has no age/sex
+    data). For an age/sex analysis the layers are used as they are.
+    """
+    if age_group != "ppp":
+        return cohorts.astype(float)
+    
+    totals = cohorts.sum(axis=1, keepdims=True)
+    national = cohorts.sum(axis=0) / max(cohorts.sum(), 1e-12)
+    shares = np.where(totals > 0, cohorts / np.where(totals > 0, totals, 1), national)
+    return shares * base_gdf['total_population'].to_numpy(dtype=float)[:, np.newaxis]
+
+def add_cohort_indicators(gdf, cohorts):
+    """Add under-5 and women of reproductive age (15-49) totals derived from the cohorts"""
+    gdf = gdf.copy()
+    gdf['under5_population'] = cohorts[:, COHORT_UNDER5].sum(axis=1)
+    gdf['wra_population'] = cohorts[:, COHORT_WRA].sum(axis=1)
+    return gdf
+
+def build_leslie_matrix(total_fertility, mortality_multiplier=1.0, migration_rate=0.0):
+    """
+    Annual cohort-component projection matrix over the (sex, age group) cohorts.
+    
+    Each year a cohort survives with its age-specific rate, 1/width of it ages into the
+    next group, women of reproductive age give births into the 0-1 group of each sex,
+    and net migration scales every cohort.
+    """
+    num_ages = len(COHORT_AGE_CODES)
+    sexes = list(SEX_OPTIONS.values())
+    matrix = np.zeros((len(sexes) * num_ages, len(sexes) * num_ages))
+    
+    mortality = np.asarray(COHORT_MORTALITY) * mortality_multiplier
+    survival = {}
+    
+    for sex in sexes:
+        sex_mortality = mortality * (COHORT_MALE_MORTALITY_RATIO if sex == "m" else 1.0)
+        survival[sex] = 1 - np.clip(sex_mortality, 0, 1)
+        offset = cohort_index(sex, COHORT_AGE_CODES[0])
+        
+        for i, width in enumerate(COHORT_AGE_WIDTHS):
+            if width is None:
+                matrix[offset + i, offset + i] = survival[sex][i]
+            else:
+                matrix[offset + i, offset + i] = survival[sex][i] * (1 - 1 / width)
+                matrix[offset + i + 1, offset + i] = survival[sex][i] / width
+    
+    # Births, split by the sex ratio at birth; newborns face half a year of infant mortality
+    male_share = SEX_RATIO_AT_BIRTH / (1 + SEX_RATIO_AT_BIRTH)
+    for age_group, share in COHORT_FERTILITY_SHARES.items():
+        asfr = total_fertility * share / 5
+        mother = cohort_index("f", age_group)
+        for sex, sex_share in [("m", male_share), ("f", 1 - male_share)]:
+            newborn_survival = 1 - (1 - survival[sex][0]) / 2
+            matrix[cohort_index(sex, COHORT_AGE_CODES[0]), mother] += asfr * sex_share * newborn_survival
+    
+    return matrix * (1 + migration_rate / 100)
+
+def project_cohort_components(base_gdf, base_year, cohorts, num_years, total_fertility,
+                              mortality_multiplier=1.0, migration_rate=0.0, age_group="ppp", sex="both"):
+    """
+    Project population with the cohort-component method.
+    
+    cohorts holds per-unit age/sex zonal totals (units × cohorts, see cohort_index) and is
+    turned into starting cohorts by baseline_cohorts. All units advance together: each
+    year is one (units × cohorts) @ (cohorts × cohorts) product.
+    
+    Returns the same structure as project_population (one scenario), with the projected
+    'under5_population' and 'wra_population' added, the projected 'cohorts' (scenarios ×
+    units × cohorts × years) and the implied average annual growth rate of each unit as
+    its growth rate.
+    """
+    num_units = cohorts.shape[0]
+    years = list(range(base_year + 1, base_year + 1 + num_years))
+    base_values = base_gdf['total_population'].to_numpy(dtype=float)
+    
+    state = baseline_cohorts(base_gdf, cohorts, age_group)
+    transition = build_leslie_matrix(total_fertility, mortality_multiplier, migration_rate).T
+    
+    # years × units × cohorts
+    states = np.empty((num_years, num_units, state.shape[1]))
+    for t in range(num_years):
+        state = state @ transition
+        states[t] = state
+    
+    if age_group == "ppp":
+        target = states.sum(axis=2)
+    else:
+        target = states[:, :, cohort_index(sex, age_group)]
+    
+    # units × years
+    target = target.T
+    ratio = np.divide(target, base_values[:, np.newaxis],
+                      out=np.zeros_like(target), where=base_values[:, np.newaxis] > 0)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        implied_rate = (np.power(ratio[:, -1], 1 / num_years) - 1) * 100
+    implied_rate = np.where(np.isfinite(implied_rate) & (base_values > 0), implied_rate, 0.0)
+    
+    return {
+        'years': years,
+        'scenarios': [COHORT_SCENARIO],
+        'columns': ['total_population', 'mean_density', 'under5_population', 'wra_population'],
+        'growth_rates': implied_rate[np.newaxis, :],
+        'total_population': target[np.newaxis],
+        'mean_density': (base_gdf['mean_density'].to_numpy(dtype=float)[:, np.newaxis] * ratio)[np.newaxis],
+        'under5_population': states[:, :, COHORT_UNDER5].sum(axis=2).T[np.newaxis],
+        'wra_population': states[:, :, COHORT_WRA].sum(axis=2).T[np.newaxis],
+        'cohorts': states.transpose(1, 2, 0)[np.newaxis],
+    }
+
+def long_format_table(units_gdf, population, base_year):
+    """
+    Long-format results, one row per scenario, year and unit, built in one step from the
+    scenarios × units × years population matrix.
+    
+    Unit attributes are gathered by row index and each population column is a reshape of
+    its matrix, so no per-year frames are copied and concatenated. Values that are the
+    same for the whole analysis are left to the metadata sheet.
+    """
+    scenarios, years = population['scenarios'], population['years']
+    num_units = len(units_gdf)
+    unit_rows = np.tile(np.arange(num_units), len(scenarios) * len(years))
+    year_values = np.repeat(np.tile(np.asarray(years), len(scenarios)), num_units)
+    
+    table = {'year': year_values, 'is_baseline': year_values == base_year, 'is_projected': year_values != base_year}
+    if len(scenarios) > 1:
+        table['scenario'] = np.repeat(np.asarray(scenarios, dtype=object), len(years) * num_units)
+    if 'growth_rates' in population:
+        # Per-unit rates (identical for every unit under a national rate), repeated over years
+        rates = np.stack([np.broadcast_to(np.asarray(rate, dtype=float), (num_units,))
+                          for rate in population['growth_rates']])
+        table['growth_rate_percent'] = np.repeat(rates[:, np.newaxis, :], len(years), axis=1).ravel()
+    if 'raking_factors' in population:
+        table['raking_factor'] = np.repeat(population['raking_factors'].ravel(), num_units)
+    
+    attributes = units_gdf.drop(columns=['geometry'] + [column for column in population['columns']
+                                                         if column in units_gdf.columns])
+    name_columns = sorted(column for column in attributes.columns if column.startswith('NAME_'))
+    for column in name_columns:
+        table[column] = attributes[column].to_numpy()[unit_rows]
+    
+    value_order = ['total_population'] + band_columns() + ['mean_density', 'under5_population', 'wra_population']
+    value_columns = ([column for column in value_order if column in population['columns']] +
+                     [column for column in population['columns'] if column not in value_order])
+    for column in value_columns:
+        # (scenarios, units, years) -> rows ordered by scenario, year, unit
+        table[column] = population[column].transpose(0, 2, 1).ravel()
+    
+    for column in attributes.columns:
+        if column not in name_columns:
+            table[column] = attributes[column].to_numpy()[unit_rows]
+    
+    return pd.DataFrame(table)
+
+def summarize_years(population, base_year, total_bands=None):
+    """
+    Summary sheet: totals and per-unit statistics of each scenario and year, computed
+    along the unit axis of the population matrix in one step.
+    
+    total_bands (scenarios × percentiles × projected years) adds the percentiles of the
+    simulated totals; for the baseline these equal the observed total.
+    """
+    scenarios, years = population['scenarios'], population['years']
+    values = population['total_population'].astype(np.float64)
+    num_units = values.shape[1]
+    
+    statistics = {
+        'Total Population': np.nansum(values, axis=1),
+        'Mean per Unit': np.nanmean(values, axis=1),
+        'Std Dev': np.nanstd(values, axis=1, ddof=1) if num_units > 1 else np.full(values[:, 0].shape, np.nan),
+        'Minimum': np.nanmin(values, axis=1),
+        'Maximum': np.nanmax(values, axis=1),
+    }
+    
+    summary = {}
+    if len(scenarios) > 1:
+        summary['Scenario'] = np.repeat(scenarios, len(years))
+    summary['Year'] = np.tile(years, len(scenarios))
+    summary['Type'] = np.where(summary['Year'] == base_year, 'Baseline', 'Projected')
+    for name, statistic in statistics.items():
+        summary[name] = [f"{value:,.0f}" for value in statistic.ravel()]
+    summary['Units Analyzed'] = num_units
+    
+    if total_bands is not None:
+        # Percentiles of the simulated total, not the sum of unit percentiles
+        baseline = np.repeat(statistics['Total Population'][:, np.newaxis, :1], len(UNCERTAINTY_PERCENTILES), axis=1)
+        bands = np.concatenate([baseline, total_bands], axis=2)
+        for i, percentile in enumerate(UNCERTAINTY_PERCENTILES):
+            summary[f'Total P{percentile}'] = [f"{value:,.0f}" for value in bands[:, i, :].ravel()]
+    
+    return pd.DataFrame(summary)
+
+def natural_breaks(values, num_classes, max_bins=JENKS_MAX_BINS):
+    """
+    Jenks natural breaks by Fisher's exact dynamic programming.
+    
+    Sorted values are grouped into at most max_bins weighted bins (distinct values, or
+    equal-count groups when there are more), so the optimisation is O(classes * bins^2)
+    however many units there are. Within-class sums of squares of every bin range come
+    from prefix sums as one matrix, and each class is added with one vectorized minimum.
+    
+    Returns:
+    - Increasing class edges: minimum, upper bound of each class (the last is the maximum)
+    """
+    sorted_values = np.sort(values)
+    distinct, counts = np.unique(sorted_values, return_counts=True)
+    
+    if len(distinct) <= max_bins:
+        weights, means, uppers = counts.astype(float), distinct, distinct
+    else:
+        starts = np.unique(np.linspace(0, len(sorted_values), max_bins + 1).astype(int))
+        weights = np.diff(starts).astype(float)
+        means = np.add.reduceat(sorted_values, starts[:-1]) / weights
+        uppers = sorted_values[starts[1:] - 1]
+    
+    num_bins = len(means)
+    num_classes = min(num_classes, num_bins)
+    
+    # Within-class sum of squares of bins i..j, infinite for j < i
+    cum_weight = np.concatenate([[0], np.cumsum(weights)])
+    cum_sum = np.concatenate([[0], np.cumsum(weights * means)])
+    cum_squares = np.concatenate([[0], np.cumsum(weights * means ** 2)])
+    i, j = np.arange(num_bins)[:, None], np.arange(num_bins)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        range_sum = cum_sum[j + 1] - cum_sum[i]
+        cost = cum_squares[j + 1] - cum_squares[i] - range_sum ** 2 / (cum_weight[j + 1] - cum_weight[i])
+    cost = np.where(j >= i, np.maximum(cost, 0), np.inf)
+    
+    # best[j]: least total cost of bins 0..j in c classes; starts[c][j]: first bin of the last class
+    best = cost[0]
+    class_starts = []
+    for _ in range(1, num_classes):
+        previous = np.concatenate([[np.inf], best[:-1]])
+        candidates = previous[:, None] + cost
+        start = np.argmin(candidates, axis=0)
+        best = candidates[start, np.arange(num_bins)]
+        class_starts.append(start)
+    
+    # Walk back from the last bin to find where each class ends
+    upper_bins = [num_bins - 1]
+    for start in reversed(class_starts):
+        upper_bins.append(start[upper_bins[-1]] - 1)
+    
+    return np.concatenate([[sorted_values[0]], uppers[upper_bins[::-1][:-1]], [sorted_values[-1]]])
+
+def classify_breaks(values, method, num_classes):
+    """
+    Class edges for a classed choropleth.
+    
+    Parameters:
+    - values: all values the classes must cover (e.g. every mapped year)
+    - method: one of MAP_CLASSIFICATIONS other than "Continuous"
+    - num_classes: number of classes (fewer if the values have fewer distinct levels)
+    
+    Returns:
+    - Tuple of increasing edges (number of classes + 1), or None without finite values
+    """
+    values = np.asarray(values, dtype=float).ravel()
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return None
+    
+    if method == "Quantile":
+        breaks = np.quantile(values, np.linspace(0, 1, num_classes + 1))
+    elif method == "Equal interval":
+        breaks = np.linspace(values.min(), values.max(), num_classes + 1)
+    else:
+        breaks = natural_breaks(values, num_classes)
+    
+    breaks = np.unique(breaks)
+    if len(breaks) < 2:
+        breaks = np.array([breaks[0] - 0.5, breaks[0] + 0.5])
+    return tuple(float(b) for b in breaks)
+
+def format_class_break(value, _position=None):
+    """Colorbar label of a class break"""
+    return f"{value:,.0f}" if abs(value) >= 100 else f"{value:,.3g}"
+
+def build_map_template(units_gdf, color_scheme, label="Population", render_mode="Auto", boundaries=True,
+                       breaks=None):
+    """
+    Draw a set of boundaries once for repeated choropleth maps.
+    
+    Creates the figure, the colorbar and the title, laid out like GeoDataFrame.plot.
+    Each map then only recolors the template with update_map_template. With class
+    breaks the map is classed (one colour per class, equal-width colorbar entries) and
+    every map uses the same classes; otherwise the colours follow each map's data range.
+    
+    In vector mode the polygons are one collection (multipolygons exploded into parts).
+    In raster mode the units are burnt once into a label raster covering the axes at
+    RASTER_MAP_DPI, and each map is a lookup of unit colours into that raster, so its
+    cost depends on the number of pixels rather than polygons. The boundaries can be
+    overlaid as vector lines. "Auto" uses raster mode above RASTER_RENDER_THRESHOLD parts.
+    
+    Returns:
+    - Dictionary with 'figure', 'axes', 'mappable' (drives the colorbar), 'colorbar',
+      'title', 'mode' and, per mode, 'collection' and 'part_index' (vector) or
+      'image', 'labels' and 'cmap' (raster)
+    """
+    parts, part_index = shapely.get_parts(units_gdf.geometry.to_numpy(), return_index=True)
+    is_polygon = shapely.get_type_id(parts) == 3
+    parts, part_index = parts[is_polygon], part_index[is_polygon]
+    
+    if render_mode == "Auto":
+        render_mode = "Raster" if len(parts) > RASTER_RENDER_THRESHOLD else "Vector"
+    
+    fig, ax = plt.subplots(1, 1, figsize=(12, 10), facecolor='white')
+    ax.set_facecolor('white')
+    
+    if breaks is None:
+        cmap = plt.get_cmap(color_scheme).with_extremes(bad="#e5e5e5")
+        norm = None
+    else:
+        class_colors = plt.get_cmap(color_scheme)(np.linspace(0, 1, len(breaks) - 1))
+        cmap = ListedColormap(class_colors).with_extremes(bad="#e5e5e5", under=class_colors[0], over=class_colors[-1])
+        norm = BoundaryNorm(breaks, len(breaks) - 1)
+    template = {'figure': fig, 'axes': ax, 'mode': render_mode, 'classed': breaks is not None}
+    
+    if render_mode == "Vector" or boundaries:
+        patches = [
+            PathPatch(Path.make_compound_path(
+                Path(np.asarray(part.exterior.coords)[:, :2]),
+                *[Path(np.asarray(ring.coords)[:, :2]) for ring in part.interiors]
+            ))
+            for part in parts
+        ]
+    
+    if render_mode == "Vector":
+        collection = PatchCollection(patches, cmap=cmap, norm=norm, edgecolor="black", linewidth=0.5)
+        collection.set_array(np.zeros(len(patches)))
+        ax.add_collection(collection, autolim=True)
+        template.update({'collection': collection, 'part_index': part_index, 'mappable': collection})
+    else:
+        bounds = units_gdf.total_bounds
+        ax.update_datalim([(bounds[0], bounds[1]), (bounds[2], bounds[3])])
+        template['mappable'] = ScalarMappable(norm=norm or Normalize(0, 1), cmap=cmap)
+    
+    ax.autoscale_view()
+    
+    # Same aspect as GeoDataFrame.plot: correct for latitude on geographic coordinates
+    if units_gdf.crs is not None and units_gdf.crs.is_geographic:
+        bounds = units_gdf.total_bounds
+        ax.set_aspect(1 / np.cos(np.mean([bounds[1], bounds[3]]) * np.pi / 180))
+    else:
+        ax.set_aspect('equal')
+    
+    if breaks is None:
+        template['colorbar'] = fig.colorbar(template['mappable'], ax=ax, shrink=0.8, label=label)
+    else:
+        template['colorbar'] = fig.colorbar(template['mappable'], ax=ax, shrink=0.8, label=label,
+                                            spacing='uniform', format=FuncFormatter(format_class_break))
+    template['title'] = ax.set_title(" ", fontweight='bold', fontsize=14, color='black', pad=20)
+    ax.set_axis_off()
+    plt.tight_layout()
+    
+    if render_mode == "Raster":
+        # Label raster over the final axes box: unit index per pixel, -1 outside all units
+        ax.apply_aspect()
+        position = ax.get_position()
+        fig_width, fig_height = fig.get_size_inches()
+        width = max(1, int(round(position.width * fig_width * RASTER_MAP_DPI)))
+        height = max(1, int(round(position.height * fig_height * RASTER_MAP_DPI)))
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+        
+        transform = rasterio.transform.from_bounds(xlim[0], ylim[0], xlim[1], ylim[1], width, height)
+        shapes = [(geometry, i) for i, geometry in enumerate(units_gdf.geometry)
+                  if geometry is not None and not geometry.is_empty]
+        labels = rasterio.features.rasterize(shapes, out_shape=(height, width), transform=transform,
+                                             fill=-1, dtype='int32')
+        
+        image = ax.imshow(np.zeros((height, width, 4), dtype=np.uint8), extent=(*xlim, *ylim),
+                          interpolation='nearest', aspect=ax.get_aspect())
+        ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
+        template.update({'image': image, 'labels': labels, 'cmap': cmap})
+        
+        if boundaries:
+            outlines = PatchCollection(patches, facecolor='none', edgecolor="black", linewidth=0.5)
+            ax.add_collection(outlines, autolim=False)
+    
+    return template
+
+def animation_palette(cmap):
+    """Palette image shared by all GIF frames: greys, the no-data colour and the colormap"""
+    greys = np.repeat(np.linspace(0, 255, ANIMATION_GREYS)[:, None], 3, axis=1)
+    ramp = cmap(np.linspace(0, 1, 255 - ANIMATION_GREYS))[:, :3] * 255
+    colors = np.vstack([greys, np.asarray(cmap.get_bad())[None, :3] * 255, ramp])
+    
+    palette = Image.new('P', (1, 1))
+    palette.putpalette(np.round(colors).astype(np.uint8).ravel().tolist())
+    return palette
+
+def render_animation_frame(fig):
+    """RGB image of a map figure at ANIMATION_DPI; the whole figure, so every frame has the same size"""
+    image_buffer = BytesIO()
+    fig.savefig(image_buffer, format='png', dpi=ANIMATION_DPI, facecolor='white')
+    image_buffer.seek(0)
+    return Image.open(image_buffer).convert('RGB')
+
+def write_maps_animation(template, map_tasks, path, animation_format="GIF"):
+    """
+    Write an animation with one frame per (values, title) task to a file, a frame at a time.
+    
+    GIF frames are quantized to one shared palette and each is encoded on its own and
+    appended after the common header, so no frame is kept once written. MP4 frames are
+    piped to ffmpeg as they are drawn.
+    """
+    if animation_format == "MP4":
+        writer = FFMpegWriter(fps=1 / ANIMATION_FRAME_SECONDS)
+        with writer.saving(template['figure'], path, ANIMATION_DPI):
+            for values, title in map_tasks:
+                update_map_template(template, values, title)
+                writer.grab_frame(facecolor='white')
+        return
+    
+    palette = animation_palette(template['mappable'].cmap)
+    with open(path, 'wb') as output:
+        for i, (values, title) in enumerate(map_tasks):
+            frame = render_animation_frame(update_map_template(template, values, title))
+            frame = frame.quantize(palette=palette, dither=Image.Dither.NONE)
+            if i == 0:
+                header, _ = GifImagePlugin.getheader(frame, info={'loop': 0, 'optimize': False})
+                output.writelines(header)
+            output.writelines(GifImagePlugin.getdata(frame, duration=int(ANIMATION_FRAME_SECONDS * 1000)))
+        output.write(b";")  # GIF trailer
+
+def render_maps(template, map_tasks, png_indices=None, workers=MAP_RENDER_WORKERS):
+    """
+    Render maps of a template as PNG (for display).
+    
+    With several workers, a process pool receives the template (geometry drawn once in
+    this process) through its initializer and then only the per-year values. Workers are
+    started by a fork server (or spawned) rather than forked from this multithreaded
+    server. Maps a worker could not render are drawn here afterwards, keeping every map
+    the pool did return.
+    
+    Parameters:
+    - template: map template from build_map_template
+    - map_tasks: list of (values per unit, title), in year order
+    - png_indices: tasks to render (default all)
+    
+    Returns:
+    - Dictionary task index -> PNG bytes
+    """
+    png_indices = list(range(len(map_tasks))) if png_indices is None else list(png_indices)
+    pngs = {}
+    
+    if workers > 1 and len(png_indices) > 1:
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('forkserver')
+            context.set_forkserver_preload(['map_rendering'])
+        else:
+            context = multiprocessing.get_context('spawn')
+        
+        pool = None
+        futures = {}
+        try:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(png_indices)), mp_context=context,
+                                       initializer=init_render_worker, initargs=(template,))
+            for i in png_indices:
+                futures[i] = pool.submit(render_map_task, *map_tasks[i])
+        except Exception:
+            pass  # the pool could not start; the maps it was not given are drawn below
+        finally:
+            if pool is not None:
+                # Waits for the submitted maps, dropping queued ones if submitting failed
+                pool.shutdown(cancel_futures=len(futures) < len(png_indices))
+        
+        for i, future in futures.items():
+            # Maps of a failed task or a broken pool are drawn below
+            if not future.cancelled() and future.exception() is None:
+                pngs[i] = future.result()
+    
+    for i in png_indices:
+        if i not in pngs:
+            pngs[i] = render_map_png(update_map_template(template, *map_tasks[i]))
+    return pngs
+
+@st.cache_resource
+def map_render_cache():
+    """
+    Rendered PNG maps shared across reruns and sessions, keyed by map_cache_key.
+    Sessions run in threads, so use get_map_render and store_map_render,
+    which hold the lock.
+    """
+    return {'entries': OrderedDict(), 'bytes': 0, 'lock': threading.Lock()}
+
+def build_styled_template(units_gdf, color_scheme, style):
+    """Map template for a render style: (render mode, boundary lines, class breaks or None)"""
+    render_mode, boundaries, breaks = style
+    return build_map_template(units_gdf, color_scheme, render_mode=render_mode, boundaries=boundaries, breaks=breaks)
+
+def map_cache_key(boundary_key, values, title, color_scheme, year, style):
+    """Render cache key: (boundaries, data hash, colormap, year, style)"""
+    digest = hashlib.sha1(np.ascontiguousarray(values, dtype=float).tobytes())
+    digest.update(title.encode())
+    return (boundary_key, digest.hexdigest(), color_scheme, year, style)
+
+def map_cache_keys(boundary_key, map_years, map_tasks, color_scheme, style):
+    """Render cache keys of each year's map and of the combined PDF of all years"""
+    keys = [map_cache_key(boundary_key, values, title, color_scheme, map_year, style)
+            for map_year, (values, title) in zip(map_years, map_tasks)]
+    return keys, ('pdf',) + tuple(keys)
+
+def get_map_render(key):
+    """Rendered bytes from the render cache, or None if not cached"""
+    cache = map_render_cache()
+    with cache['lock']:
+        data = cache['entries'].get(key)
+        if data is not None:
+            cache['entries'].move_to_end(key)
+    return data
+
+def store_map_render(key, data):
+    """
+    Add rendered bytes to the render cache, dropping least recently used renders until
+    it is within MAP_CACHE_BYTES, and return them (they may be evicted at any time by
+    another session, so callers keep this reference rather than reading the cache back).
+    """
+    if len(data) > MAP_CACHE_BYTES:
+        return data
+    cache = map_render_cache()
+    with cache['lock']:
+        entries = cache['entries']
+        previous = entries.pop(key, None)
+        if previous is not None:
+            cache['bytes'] -= len(previous)
+        entries[key] = data
+        cache['bytes'] += len(data)
+        while cache['bytes'] > MAP_CACHE_BYTES:
+            _, evicted = entries.popitem(last=False)
+            cache['bytes'] -= len(evicted)
+    return data
+
+def cached_map_renders(units_gdf, boundary_key, map_years, map_tasks, color_scheme, style, years=None):
+    """
+    PNG bytes per year, from the render cache where possible.
+    
+    Only maps missing from the cache are drawn; the template figure is closed as soon as
+    they are rendered, so re-displaying or re-downloading maps never touches matplotlib.
+    
+    Parameters:
+    - units_gdf, boundary_key: boundaries to draw and their boundary_cache_key
+    - map_years, map_tasks: years and their (values, title), in year order
+    - style: (render mode, boundary lines, class breaks) passed to build_styled_template
+    - years: years to return PNG maps for (default all)
+    
+    Returns:
+    - Dictionary year -> PNG bytes
+    """
+    keys, _ = map_cache_keys(boundary_key, map_years, map_tasks, color_scheme, style)
+    wanted = [i for i, map_year in enumerate(map_years) if years is None or map_year in years]
+    
+    pngs = {i: get_map_render(keys[i]) for i in wanted}
+    missing = [i for i in wanted if pngs[i] is None]
+    if missing:
+        template = build_styled_template(units_gdf, color_scheme, style)
+        try:
+            rendered = render_maps(template, map_tasks, missing)
+        finally:
+            plt.close(template['figure'])
+        
+        for i, png in rendered.items():
+            pngs[i] = store_map_render(keys[i], png)
+    
+    return {map_years[i]: pngs[i] for i in wanted}
+
+@st.cache_resource
+def export_salt():
+    """Random salt of prepared file names for this server, so their URLs cannot be derived from the inputs"""
+    return uuid.uuid4().hex
+
+def export_path(key, extension):
+    """Path in EXPORT_DIR of the prepared file for an export key"""
+    digest = hashlib.sha1((export_salt() + repr(key)).encode()).hexdigest()
+    return os.path.join(EXPORT_DIR, f"{digest}.{extension}")
+
+def new_export_file(extension):
+    """Temporary path in EXPORT_DIR to write a file to before publishing it with os.replace"""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    # Ends in the real extension, which drivers such as GeoPackage's check
+    fd, partial_path = tempfile.mkstemp(dir=EXPORT_DIR, suffix=f".part.{extension}")
+    os.close(fd)
+    return partial_path
+
+def find_export(key, extension):
+    """Path of the prepared file for an export key (marked as recently used), or None if not prepared"""
+    path = export_path(key, extension)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+def prepare_export(key, extension, write):
+    """
+    Path of the prepared file for an export key, written by write(path) on first use.
+    
+    The file is written under a temporary name and renamed into place once complete, so
+    a half-written file is never served.
+    """
+    path = find_export(key, extension)
+    if path is None:
+        partial_path = new_export_file(extension)
+        try:
+            write(partial_path)
+            os.replace(partial_path, export_path(key, extension))
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        prune_exports()
+        path = export_path(key, extension)
+    return path
+
+def prune_exports():
+    """Drop the least recently used prepared files while EXPORT_DIR is over EXPORT_DIR_BYTES, except files used in the last EXPORT_KEEP_SECONDS"""
+    files = []
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, entry.path))
+    
+    total_bytes = sum(size for _, size, _ in files)
+    recent = time.time() - EXPORT_KEEP_SECONDS
+    for modified, size, path in sorted(files):
+        if total_bytes <= EXPORT_DIR_BYTES or modified > recent:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+def export_download_link(path, label, file_name):
+    """Download link for a prepared file, served from disk rather than sent through the app"""
+    url = f"{EXPORT_URL}/{os.path.basename(path)}"
+    st.markdown(f'<a class="export-download" href="{url}" download="{html.escape(file_name)}">{html.escape(label)}</a>',
+                unsafe_allow_html=True)
+
+def prepare_maps_zip(units_gdf, boundary_key, map_years, map_tasks, color_scheme, style, folder):
+    """
+    Prepared ZIP archive with one PNG map per year, from the render cache where possible.
+    
+    The archive is written to disk one map at a time: cached maps are copied in and
+    missing ones are drawn, added and released in turn, so at most one rendered map is
+    held in memory.
+    
+    Parameters:
+    - units_gdf, boundary_key: boundaries to draw and their boundary_cache_key
+    - map_years, map_tasks: years and their (values, title), in year order
+    - style: (render mode, boundary lines, class breaks) passed to build_styled_template
+    - folder: folder name of the PNG files inside the archive
+    
+    Returns:
+    - Path of the ZIP archive in EXPORT_DIR
+    """
+    keys, _ = map_cache_keys(boundary_key, map_years, map_tasks, color_scheme, style)
+    template = None
+    
+    def write_zip(path):
+        nonlocal template
+        # PNG data is already compressed
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for map_year, key, (values, title) in zip(map_years, keys, map_tasks):
+                png = get_map_render(key)
+                if png is None:
+                    if template is None:
+                        template = build_styled_template(units_gdf, color_scheme, style)
+                    png = render_map_png(update_map_template(template, values, title))
+                archive.writestr(f"{folder}/map_{map_year}.png", png)
+    
+    try:
+        return prepare_export(('zip', folder) + tuple(keys), "zip", write_zip)
+    finally:
+        if template is not None:
+            plt.close(template['figure'])
+
+def prepare_maps_pdf(units_gdf, boundary_key, map_years, map_tasks, color_scheme, style):
+    """
+    Prepared PDF with one page per year, assembled from the rendered PNG maps.
+    
+    Years missing from the render cache are drawn (and cached) first, so the pages are the
+    maps shown in the app and nothing is drawn twice. Pages are appended to the file one
+    at a time, so at most one decoded map is held in memory.
+    
+    Parameters:
+    - units_gdf, boundary_key: boundaries to draw and their boundary_cache_key
+    - map_years, map_tasks: years and their (values, title), in year order
+    - style: (render mode, boundary lines, class breaks) passed to build_styled_template
+    
+    Returns:
+    - Path of the PDF in EXPORT_DIR
+    """
+    _, pdf_key = map_cache_keys(boundary_key, map_years, map_tasks, color_scheme, style)
+    
+    def write_pdf(path):
+        pngs = cached_map_renders(units_gdf, boundary_key, map_years, map_tasks, color_scheme, style)
+        for i, map_year in enumerate(map_years):
+            with Image.open(BytesIO(pngs[map_year])) as page:
+                # Pages are stored as JPEG; a high quality keeps labels and class edges sharp
+                page.convert('RGB').save(path, "PDF", resolution=MAP_DPI, quality=95, append=i > 0)
+    
+    return prepare_export(pdf_key, "pdf", write_pdf)
+
+def available_animation_formats():
+    """Animation formats that can be written here (MP4 needs ffmpeg)"""
+    return [animation_format for animation_format in ANIMATION_FORMATS
+            if animation_format != "MP4" or FFMpegWriter.isAvailable()]
+
+def prepare_maps_animation(units_gdf, boundary_key, map_years, map_tasks, color_scheme, style,
+                           animation_format="GIF"):
+    """
+    Prepared animation with one frame per year, drawn on first request.
+    
+    The frames are drawn on one template and encoded straight to disk by
+    write_maps_animation, so the animation is never held in memory.
+    
+    Parameters:
+    - units_gdf, boundary_key: boundaries to draw and their boundary_cache_key
+    - map_years, map_tasks: years and their (values, title), in year order
+    - style: (render mode, boundary lines, class breaks) passed to build_styled_template
+    - animation_format: one of ANIMATION_FORMATS
+    
+    Returns:
+    - Path of the GIF or MP4 file in EXPORT_DIR
+    """
+    keys, _ = map_cache_keys(boundary_key, map_years, map_tasks, color_scheme, style)
+    
+    def write_animation(path):
+        template = build_styled_template(units_gdf, color_scheme, style)
+        try:
+            write_maps_animation(template, map_tasks, path, animation_format)
+        finally:
+            plt.close(template['figure'])
+    
+    return prepare_export(('animation', animation_format) + tuple(keys), animation_format.lower(), write_animation)
+
+def export_cache_key(download_df, metadata):
+    """Data export key: hash of the exported records and the analysis parameters (not the generation time)"""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(download_df, index=False).to_numpy().tobytes())
+    digest.update(metadata[metadata['Parameter'] != 'Generated On'].to_csv(index=False).encode())
+    return digest.hexdigest()
+
+def export_units_frame(analysis):
+    """
+    One row per unit with its geometry and one column per year (and scenario) of each
+    population column, e.g. 'total_population_2025' or 'total_population_high_2025'.
+    """
+    population = analysis['population']
+    units_gdf = analysis['units_gdf']
+    frame = units_gdf.drop(columns=[column for column in population['columns'] if column in units_gdf.columns])
+    
+    per_year = {}
+    for scenario_idx, scenario in enumerate(population['scenarios']):
+        prefix = "" if len(population['scenarios']) == 1 else f"_{scenario.lower().replace(' ', '_')}"
+        for column in population['columns']:
+            for year_idx, year in enumerate(population['years']):
+                per_year[f"{column}{prefix}_{year}"] = population[column][scenario_idx, :, year_idx]
+    
+    per_year = pd.DataFrame(per_year, index=frame.index)
+    return gpd.GeoDataFrame(pd.concat([frame.drop(columns='geometry'), per_year], axis=1),
+                            geometry=frame.geometry, crs=frame.crs)
+
+def write_geoparquet(frame, path, constants, metadata):
+    """
+    Write units to a GeoParquet 1.1 file with WKB geometry and a bounding box covering.
+    
+    Rows are sorted along a Hilbert curve and written in row groups, so the per-group
+    statistics of the 'bbox' column act as a spatial index for readers that filter by
+    area. Text columns and the constant columns are dictionary encoded; the analysis
+    metadata is kept in the file metadata.
+    """
+    frame = frame.iloc[np.argsort(frame.geometry.hilbert_distance().to_numpy(), kind='stable')]
+    geometry = frame.geometry.to_numpy()
+    bounds = shapely.bounds(geometry)
+    
+    attributes = pd.DataFrame(frame.drop(columns='geometry')).reset_index(drop=True)
+    for column, value in constants.items():
+        attributes[column] = value
+    for column in attributes.columns:
+        if attributes[column].dtype == object or column in constants:
+            attributes[column] = attributes[column].astype('category')
+    
+    table = pa.Table.from_pandas(attributes, preserve_index=False)
+    table = table.append_column('geometry', pa.array(shapely.to_wkb(geometry), type=pa.binary()))
+    table = table.append_column('bbox', pa.StructArray.from_arrays(
+        [pa.array(bounds[:, i]) for i in range(4)], names=['xmin', 'ymin', 'xmax', 'ymax']
+    ))
+    
+    type_names = {0: 'Point', 1: 'LineString', 3: 'Polygon', 4: 'MultiPoint', 5: 'MultiLineString',
+                  6: 'MultiPolygon', 7: 'GeometryCollection'}
+    geometry_column = {
+        'encoding': 'WKB',
+        'geometry_types': sorted({type_names[type_id] for type_id in shapely.get_type_id(geometry).tolist()
+                                  if type_id in type_names}),
+        'bbox': [float(value) for value in frame.total_bounds],
+        'covering': {'bbox': {edge: ['bbox', edge] for edge in ['xmin', 'ymin', 'xmax', 'ymax']}},
+    }
+    if frame.crs is not None:
+        geometry_column['crs'] = frame.crs.to_json_dict()
+    geo = {'version': '1.1.0', 'primary_column': 'geometry', 'columns': {'geometry': geometry_column}}
+    
+    table = table.replace_schema_metadata({
+        **table.schema.metadata,
+        b'geo': json.dumps(geo).encode(),
+        b'analysis_metadata': json.dumps(dict(zip(metadata['Parameter'], metadata['Value'].astype(str)))).encode(),
+    })
+    pq.write_table(table, path, row_group_size=GEOPARQUET_ROW_GROUP_SIZE, compression='zstd')
+
+def write_geopackage(frame, path, constants, metadata):
+    """
+    Write units to a GeoPackage layer with an R-tree spatial index.
+    
+    The constant columns and the analysis metadata are not repeated on every unit but
+    written once, to an 'analysis_metadata' attributes table.
+    """
+    frame.to_file(path, driver="GPKG", layer="population", SPATIAL_INDEX="YES")
+    
+    rows = [(str(column), str(value)) for column, value in constants.items()]
+    rows += list(zip(metadata['Parameter'].astype(str), metadata['Value'].astype(str)))
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE analysis_metadata "
+                           "(fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, parameter TEXT, value TEXT)")
+        connection.executemany("INSERT INTO analysis_metadata (parameter, value) VALUES (?, ?)", rows)
+        connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, description) "
+                           "VALUES ('analysis_metadata', 'attributes', 'analysis_metadata', 'Analysis parameters')")
+    connection.close()
+
+def write_data_csv(frame, output, constants=None):
+    """
+    Write a DataFrame as CSV to a binary file, encoding EXPORT_CHUNK_ROWS records at a time.
+    
+    A CSV has no metadata sheet, so the values constant over the analysis (column -> value)
+    are added as leading columns of each chunk as it is written.
+    """
+    text_output = TextIOWrapper(output, encoding='utf-8', newline='')
+    # One pass even for an empty frame, so the header is always written
+    for start in range(0, len(frame), EXPORT_CHUNK_ROWS) or [0]:
+        chunk = frame.iloc[start:start + EXPORT_CHUNK_ROWS]
+        if constants:
+            chunk = pd.concat([pd.DataFrame(constants, index=chunk.index), chunk], axis=1)
+        chunk.to_csv(text_output, index=False, header=start == 0)
+    text_output.flush()
+    text_output.detach()
+
+def write_data_excel(sheets, output):
+    """
+    Write DataFrames (sheet name -> frame) as an Excel workbook to a binary file.
+    
+    Uses a write-only workbook, which streams each row to disk as it is appended instead
+    of keeping a cell object per value, so memory does not grow with the row count.
+    """
+    workbook = Workbook(write_only=True)
+    for sheet_name, frame in sheets.items():
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.append([str(column) for column in frame.columns])
+        for start in range(0, len(frame), EXPORT_CHUNK_ROWS):
+            chunk = frame.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+            # Missing values as empty cells, like DataFrame.to_excel
+            for row in chunk.where(chunk.notna(), None).itertuples(index=False, name=None):
+                worksheet.append(row)
+    workbook.save(output)
+
+def data_export_key(analysis, export_format):
+    """Export key of an analysis in one of DATA_EXPORT_FORMATS"""
+    return ('export', export_format, analysis['export_key'])
+
+def prepare_data_export(analysis, export_format):
+    """
+    Prepared file of an analysis in one of DATA_EXPORT_FORMATS, serialized to disk on
+    first request, so the same analysis is never serialized twice or held in memory.
+    """
+    def write_export(path):
+        if export_format == "CSV":
+            with open(path, 'wb') as output:
+                write_data_csv(analysis['download_df'], output, analysis['export_constants'])
+        elif export_format == "Excel":
+            with open(path, 'wb') as output:
+                write_data_excel({
+                    'Population_Data': analysis['download_df'],
+                    'Summary_Stats': analysis['summary_stats'],
+                    'Metadata': analysis['metadata'],
+                }, output)
+        elif export_format == "GeoParquet":
+            write_geoparquet(export_units_frame(analysis), path, analysis['export_constants'], analysis['metadata'])
+        else:
+            # The GeoPackage driver creates the database itself, so the empty placeholder goes first
+            os.remove(path)
+            write_geopackage(export_units_frame(analysis), path, analysis['export_constants'], analysis['metadata'])
+    
+    return prepare_export(data_export_key(analysis, export_format), DATA_EXPORT_FORMATS[export_format], write_export)
+
+def read_archive_manifest(archive_dir=RESULTS_ARCHIVE_DIR):
+    """Manifest entries of the archived runs, oldest first (empty if nothing is archived)"""
+    manifest_path = os.path.join(archive_dir, ARCHIVE_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def archive_analysis(analysis, archive_dir=RESULTS_ARCHIVE_DIR):
+    """
+    Append the records of an analysis to the results archive.
+    
+    Records are written to new files named after the run in their partition folders, so
+    earlier runs are never rewritten. The manifest line is appended last, so the manifest
+    only lists complete runs.
+    
+    Returns:
+    - Manifest entry of the run
+    """
+    download_df = analysis['download_df']
+    run_id = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    partition = analysis['archive_partition']
+    
+    table = pa.Table.from_pandas(download_df, preserve_index=False)
+    constant_columns = {'run_id': run_id, 'country': partition['country'],
+                        'admin_level': partition['admin_level'], 'analysis_type': partition['analysis_type']}
+    if 'scenario' not in download_df.columns:
+        # Single-scenario runs are labelled too, so runs can always be compared by scenario
+        constant_columns['scenario'] = analysis['scenarios'][0]
+    for column, value in constant_columns.items():
+        table = table.append_column(column, pa.array([value] * len(download_df), type=pa.string()))
+    
+    os.makedirs(archive_dir, exist_ok=True)
+    ds.write_dataset(table, os.path.join(archive_dir, ARCHIVE_RECORDS), format='parquet', partitioning=ARCHIVE_PARTITIONING,
+                     basename_template=f"part-{run_id}-{{i}}.parquet", existing_data_behavior='overwrite_or_ignore')
+    
+    metadata = analysis['metadata']
+    entry = {
+        'run_id': run_id,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        **partition,
+        'years': sorted(int(year) for year in download_df['year'].unique()),
+        'scenarios': list(analysis['scenarios']),
+        'records': len(download_df),
+        'parameters': dict(zip(metadata['Parameter'].astype(str), metadata['Value'].astype(str))),
+    }
+    with open(os.path.join(archive_dir, ARCHIVE_MANIFEST), 'a') as f:
+        f.write(json.dumps(entry) + "\n")
+    return entry
+
+def query_archive(country=None, admin_level=None, years=None, analysis_type=None, columns=None,
+                  archive_dir=RESULTS_ARCHIVE_DIR):
+    """
+    Archived records of the runs in the manifest, as a DataFrame.
+    
+    Only the partition folder fixed by country and admin level is listed, and only files
+    of runs in the manifest are used, so files of other partitions or of unfinished runs
+    are never opened. Years and analysis type are resolved against the folder names.
+    
+    Parameters:
+    - country, admin_level, analysis_type: partition values to keep (None for all)
+    - years: list of years to keep (None for all)
+    - columns: columns to read (None for all)
+    """
+    run_ids = {entry['run_id'] for entry in read_archive_manifest(archive_dir)}
+    records_dir = os.path.join(archive_dir, ARCHIVE_RECORDS)
+    
+    partition_dir = records_dir
+    for field, value in [('country', country), ('admin_level', admin_level)]:
+        if value is None:
+            break
+        # Hive folder names as written by ds.write_dataset (URI-encoded values)
+        partition_dir = os.path.join(partition_dir, f"{field}={quote(str(value), safe='')}")
+    
+    # Files are named part-<run_id>-<i>.parquet by archive_analysis
+    paths = [os.path.join(folder, name) for folder, _, names in os.walk(partition_dir) for name in names
+             if name.startswith("part-") and name[len("part-"):].rsplit("-", 1)[0] in run_ids]
+    
+    condition = ds.scalar(True)
+    for field, value in [('country', country), ('admin_level', admin_level), ('analysis_type', analysis_type)]:
+        if value is not None:
+            condition &= ds.field(field) == str(value)
+    if years is not None:
+        condition &= ds.field('year').isin([int(year) for year in years])
+    
+    dataset = ds.dataset(paths, format='parquet', partitioning=ARCHIVE_PARTITIONING, partition_base_dir=records_dir)
+    fragments = list(dataset.get_fragments(filter=condition))
+    if not fragments:
+        return pd.DataFrame(columns=columns)
+    
+    # Later runs may have columns earlier ones lack (raking factors, age bands), so read
+    # with the union of the file schemas rather than the schema of the first file
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments] + [ARCHIVE_PARTITIONING.schema],
+                              promote_options='permissive')
+    dataset = ds.dataset([fragment.path for fragment in fragments], schema=schema, format='parquet',
+                         partitioning=ARCHIVE_PARTITIONING, partition_base_dir=records_dir)
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+# Main app layout with custom header
+st.markdown("""
+<h1>
+    WorldPop Population Data Analysis
+</h1>
+<p style='text-align: center; color: #9ca3af; font-size: 1.2rem; margin-top: -1rem; margin-bottom: 2rem;'>
+    Analyze population distribution for public health planning and intervention targeting
+</p>
+""", unsafe_allow_html=True)
+
+# Sidebar for controls
+with st.sidebar:
+    st.markdown("## Analysis Parameters")
+    
+    # Data source selection
+    data_source = st.radio(
+        "Select Data Source", 
+        ["GADM Database", "Upload Custom Shapefile"],
+        help="Choose between official GADM boundaries or upload your own shapefile"
+    )
+    st.session_state.data_source = data_source
+    
+    if data_source == "GADM Database":
+        # Country and admin level selection
+        country = st.selectbox("Select Country", list(COUNTRY_OPTIONS.keys()), 
+                              help="Select any African country")
+        admin_level = st.selectbox("Administrative Level", [0, 1, 2, 3, 4], 
+                                  help="0=Country, 1=Regions, 2=Districts, 3=Communes, 4=Localities")
+        
+        # Show admin level description
+        level_descriptions = {
+            0: "Country boundary",
+            1: "First-level admin (regions/states)",
+            2: "Second-level admin (districts/provinces)", 
+            3: "Third-level admin (communes/counties)",
+            4: "Fourth-level admin (localities/wards)"
+        }
+        st.caption(f"Level {admin_level}: {level_descriptions.get(admin_level, 'Administrative division')}")
+        
+        # Set variables for GADM mode
+        country_code = COUNTRY_OPTIONS[country]
+        use_custom_shapefile = False
+        
+        # Update session state
+        st.session_state.country = country
+        st.session_state.country_code = country_code
+        st.session_state.admin_level = admin_level
+        st.session_state.use_custom_shapefile = False
+        
+    else:  # Upload Custom Shapefile
+        st.markdown("**Upload Shapefile Components**")
+        st.caption("Upload all required files for your shapefile")
+        
+        # File uploaders - Required files
+        shp_file = st.file_uploader("Shapefile (.shp)", type=['shp'], help="Main geometry file (required)")
+        shx_file = st.file_uploader("Shape Index (.shx)", type=['shx'], help="Spatial index file (required)")
+        dbf_file = st.file_uploader("Attribute Table (.dbf)", type=['dbf'], help="Attribute data file (required)")
+        
+        # Optional projection file
+        prj_file = st.file_uploader("Projection File (.prj)", type=['prj'], 
+                                   help="Coordinate system definition (optional but recommended)")
+        
+        # Check if required files are uploaded
+        if shp_file and shx_file and dbf_file:
+            st.success("Required files uploaded successfully!")
+            use_custom_shapefile = True
+            
+            # Show file details
+            with st.expander("File Details"):
+                st.write(f"**SHP file**: {shp_file.name} ({shp_file.size:,} bytes)")
+                st.write(f"**SHX file**: {shx_file.name} ({shx_file.size:,} bytes)")
+                st.write(f"**DBF file**: {dbf_file.name} ({dbf_file.size:,} bytes)")
+                if prj_file:
+                    st.write(f"**PRJ file**: {prj_file.name} ({prj_file.size:,} bytes)")
+                    st.success("Projection file included - coordinate system will be automatically detected!")
+                else:
+                    st.warning("No projection file - will assume WGS84 coordinate system")
+        else:
+            use_custom_shapefile = False
+            st.info("Please upload .shp, .shx, and .dbf files to proceed")
+            
+            # Show upload requirements
+            with st.expander("Shapefile Upload Requirements"):
+                st.markdown("""
+                **Required Files:**
+                - **.shp**: Contains the geometry data
+                - **.shx**: Spatial index for quick access
+                - **.dbf**: Attribute table with feature data
+                
+                **Optional Files:**
+                - **.prj**: Coordinate system definition (highly recommended)
+                
+                **Important Notes:**
+                - All files must have the same base name
+                - Maximum file size: 200MB per file
+                - If no .prj file is provided, WGS84 coordinate system will be assumed
+                - Including a .prj file prevents coordinate system errors
+                - Ensure your shapefile contains administrative boundaries or areas of interest
+                """)
+        
+        # Set variables for custom mode
+        country = "Custom Area"
+        country_code = "CUSTOM"
+        admin_level = "Custom"
+        
+        # Update session state
+        st.session_state.country = country
+        st.session_state.country_code = country_code
+        st.session_state.admin_level = admin_level
+        st.session_state.use_custom_shapefile = use_custom_shapefile
+
+    st.markdown("---")
+    
+    # Year selection and projection
+    st.markdown("### Year Selection & Analysis")
+    
+    # Multi-year projection toggle FIRST
+    enable_projection = st.checkbox("Enable Multi-Year Projection", value=False,
+                                   help="Project population forward from 2020 baseline using growth rate")
+    
+    # FIXED IF-ELSE LOGIC
+    if enable_projection:
+        # Automatically use 2020 as baseline for projections
+        year = 2020
+        st.info("📊 **2020 automatically selected as baseline** for multi-year projections (most recent WorldPop data)")
+        
+        projection_method = st.radio(
+            "Projection Method",
+            ["Compound growth", "Cohort-component (age/sex)"],
+            help="Cohort-component projects the WorldPop age/sex structure with fertility, mortality and migration"
+        )
+        
+        col_proj1, col_proj2 = st.columns(2)
+        
+        with col_proj1:
+            projection_years = st.number_input(
+                "Number of Years to Project",
+                min_value=1,
+                max_value=20,
+                value=5,
+                step=1,
+                help="Number of years forward from 2020 (e.g., 5 = years 2021-2025)"
+            )
         
         # Calculate projected years (always forward from 2020)
         projected_years_list = list(range(2021, 2021 + projection_years))
         
-        if growth_rate >= 0:
-            st.success(f"📈 Projecting **growth** from 2020 baseline for years: {', '.join(map(str, projected_years_list))} at **{growth_rate}%** annual rate")
+        rate_source = "National rate"
+        fit_window = None
+        enable_uncertainty = False
+        control_table = None
+        rate_table = None
+        rate_key_column = None
+        rate_columns = []
+        scenario_rates = {}
+        map_scenario = None
+        
+        if projection_method == "Cohort-component (age/sex)":
+            growth_rate = 0.0
+            
+            with col_proj2:
+                total_fertility = st.number_input("Total Fertility Rate", min_value=1.0, max_value=8.0,
+                                                  value=4.5, step=0.1, format="%.1f",
+                                                  help="Average births per woman over her reproductive life")
+            
+            col_cc1, col_cc2 = st.columns(2)
+            with col_cc1:
+                mortality_multiplier = st.number_input("Mortality Level (×)", min_value=0.5, max_value=2.0,
+                                                       value=1.0, step=0.05, format="%.2f",
+                                                       help="Multiplier on the default age-specific mortality schedule")
+            with col_cc2:
+                migration_rate = st.number_input("Net Migration (%/yr)", min_value=-5.0, max_value=5.0,
+                                                 value=0.0, step=0.1, format="%.2f",
+                                                 help="Annual net migration as a share of each cohort")
+            
+            st.success(f"👪 Cohort-component projection from 2020 baseline for years: {', '.join(map(str, projected_years_list))}")
+            st.info("All 36 WorldPop age/sex layers are processed for the baseline year. "
+                    "Under-5 and women 15-49 projections are added to the downloads.")
+        
         else:
-            st.warning(f"📉 Projecting **decline** from 2020 baseline for years: {', '.join(map(str, projected_years_list))} at **{growth_rate}%** annual rate")
+            with col_proj2:
+                growth_rate = st.number_input(
+                    "Annual Growth Rate (%)",
+                    min_value=-10.0,
+                    max_value=10.0,
+                    value=2.5,
+                    step=0.1,
+                    format="%.2f",
+                    help="Annual population growth rate from 2020 baseline (positive = growth, negative = decline)"
+                )
+            
+            if growth_rate >= 0:
+                st.success(f"📈 Projecting **growth** from 2020 baseline for years: {', '.join(map(str, projected_years_list))} at **{growth_rate}%** annual rate")
+            else:
+                st.warning(f"📉 Projecting **decline** from 2020 baseline for years: {', '.join(map(str, projected_years_list))} at **{growth_rate}%** annual rate")
+            
+            # Per-unit growth rates and scenarios
+            rate_source = st.radio(
+                "Growth Rate Source",
+                ["National rate", "Per-unit rate table", "Fitted from WorldPop history"],
+                help="Apply one national rate, upload district-specific rates, or fit each unit's rate to past WorldPop years"
+            )
+            
+            if rate_source == "Fitted from WorldPop history":
+                fit_window = st.selectbox("Fit Window", list(GROWTH_FIT_WINDOWS.keys()),
+                                          help="WorldPop years up to the baseline used for each unit's log-linear fit")
+                st.caption(f"Units that cannot be fitted use the national rate ({growth_rate}%)")
+            elif rate_source == "Per-unit rate table":
+                rate_file = st.file_uploader(
+                    "Growth Rate Table", type=['csv', 'xlsx', 'xls'],
+                    help="One row per unit: a name/ID column matching a boundary attribute and one or more rate columns (%). Each rate column is projected as a scenario."
+                )
+                
+                if rate_file:
+                    try:
+                        rate_table = load_uploaded_table(rate_file)
+                        numeric_columns = list(rate_table.select_dtypes('number').columns)
+                        key_candidates = [col for col in rate_table.columns if col not in numeric_columns] or list(rate_table.columns)
+                        
+                        rate_key_column = st.selectbox("Unit Name/ID Column", key_candidates,
+                                                       help="Matched automatically against the boundary attributes")
+                        rate_options = [col for col in numeric_columns if col != rate_key_column]
+                        rate_columns = st.multiselect("Rate Columns (one scenario each)", rate_options,
+                                                      default=rate_options[:1],
+                                                      help="e.g. select low, medium and high columns to compare scenarios")
+                        st.caption(f"Units missing from the table use the national rate ({growth_rate}%)")
+                    except Exception as e:
+                        st.error(f"Error loading rate table: {str(e)}")
+                        rate_table = None
+                else:
+                    st.info("Upload a CSV or Excel table of per-unit growth rates")
+            else:
+                compare_scenarios = st.checkbox("Compare Low/Medium/High Scenarios", value=False,
+                                                help="Project low and high rates alongside the rate above (medium)")
+                
+                if compare_scenarios:
+                    col_low, col_high = st.columns(2)
+                    with col_low:
+                        low_rate = st.number_input("Low Rate (%)", min_value=-10.0, max_value=10.0,
+                                                   value=max(growth_rate - 1.0, -10.0), step=0.1, format="%.2f")
+                    with col_high:
+                        high_rate = st.number_input("High Rate (%)", min_value=-10.0, max_value=10.0,
+                                                    value=min(growth_rate + 1.0, 10.0), step=0.1, format="%.2f")
+                    scenario_rates = {"Low": low_rate, "Medium": growth_rate, "High": high_rate}
+            
+            scenario_names = rate_columns if rate_table is not None and rate_columns else list(scenario_rates.keys())
+            if len(scenario_names) > 1:
+                map_scenario = st.selectbox("Scenario to Map", scenario_names,
+                                            index=len(scenario_names) // 2,
+                                            help="All scenarios are included in the data downloads")
+            
+            enable_uncertainty = st.checkbox("Uncertainty Bands (Monte Carlo)", value=False,
+                                             help="Sample uncertain growth rates and report percentile bands per unit")
+            
+            if enable_uncertainty:
+                col_unc1, col_unc2, col_unc3 = st.columns(3)
+                with col_unc1:
+                    rate_sd = st.number_input("Rate Uncertainty (SD, %)", min_value=0.0, max_value=5.0,
+                                              value=0.5, step=0.1, format="%.2f",
+                                              help="Uncertainty of each unit's long-run growth rate")
+                with col_unc2:
+                    annual_sd = st.number_input("Annual Variability (SD, %)", min_value=0.0, max_value=5.0,
+                                                value=0.3, step=0.1, format="%.2f",
+                                                help="Year-to-year fluctuation around the growth rate")
+                with col_unc3:
+                    num_draws = st.selectbox("Draws", UNCERTAINTY_DRAWS, index=0)
+                
+                st.caption(f"Downloads include {', '.join(band_columns())} next to total_population")
+        
+        # Calibration to official national totals (e.g. UN WPP or census projections)
+        enable_raking = st.checkbox("Calibrate to National Totals", value=False,
+                                    help="Rake unit projections so each year sums to an uploaded national total")
+        
+        if enable_raking:
+            control_file = st.file_uploader(
+                "National Control Totals", type=['csv', 'xlsx', 'xls'],
+                help="One row per year: a year column and a national total column. With cohort-component projections, "
+                     "optional age/sex columns named like m_0, f_15 (WorldPop codes) are fitted by iterative proportional fitting."
+            )
+            
+            if control_file:
+                try:
+                    control_table = load_uploaded_table(control_file)
+                    numeric_columns = list(control_table.select_dtypes('number').columns)
+                    control_year_column = st.selectbox("Year Column", numeric_columns,
+                                                       index=next((i for i, col in enumerate(numeric_columns)
+                                                                   if str(col).lower() == 'year'), 0))
+                    total_options = [col for col in numeric_columns if col != control_year_column]
+                    control_total_column = st.selectbox("Total Column", total_options)
+                except Exception as e:
+                    st.error(f"Error loading control totals: {str(e)}")
+                    control_table = None
+            else:
+                st.info("Upload a CSV or Excel table of national totals by year")
     
     else:
         # Single year analysis - allow any year selection
@@ -1236,9 +3109,19 @@ with st.sidebar:
                            help="Select any year 2000-2020 for single-year population analysis")
         
         # Set default values for projection variables
+        projection_method = "Compound growth"
         projection_years = 0
         growth_rate = 0.0
         projected_years_list = []
+        rate_source = "National rate"
+        fit_window = None
+        enable_uncertainty = False
+        enable_raking = False
+        control_table = None
+        rate_table = None
+        rate_columns = []
+        scenario_rates = {}
+        map_scenario = None
         
         st.info(f"📅 Analyzing population data for year **{year}** (single year mode)")
     
@@ -1267,6 +3150,11 @@ with st.sidebar:
         sex = SEX_OPTIONS[sex_name]
         
         st.info(f"Analyzing: {age_group_name}, {sex_name}")
+        
+        if enable_raking:
+            st.caption(f"Calibration uses the national {age_group_name}, {sex_name} total: a "
+                       f"'{cohort_column_name(sex, age_group)}' column in the control table, or all age/sex columns "
+                       f"with cohort-component projections. Without one, projections are not calibrated.")
 
     st.markdown("---")
     
@@ -1275,6 +3163,26 @@ with st.sidebar:
     show_statistics = st.checkbox("Show Statistics", value=True)
     color_scheme = st.selectbox("Color Scheme", 
                                ["YlOrRd", "viridis", "plasma", "Reds", "Blues", "Purples"])
+    classification = st.selectbox("Classification", MAP_CLASSIFICATIONS,
+                                  help="Classed maps keep outliers such as large cities from washing out other "
+                                       "units, and use the same classes for every year so maps are comparable")
+    if classification != "Continuous":
+        num_classes = st.slider("Number of Classes", min_value=3, max_value=9, value=5)
+    else:
+        num_classes = None
+    render_mode = st.selectbox("Map Rendering", MAP_RENDER_MODES,
+                               help=f"Raster rendering keeps maps and PDFs fast and small for very large boundary sets "
+                                    f"(Auto: above {RASTER_RENDER_THRESHOLD:,} polygons)")
+    show_boundaries = st.checkbox("Show Boundary Lines", value=True,
+                                  help="Draw unit outlines over raster-rendered maps")
+    map_display = st.radio("Map Display", MAP_DISPLAY_MODES,
+                           help="Selected year renders maps only when picked, so the first map appears "
+                                "without waiting for every projection year; the PDF is prepared on request")
+    
+    st.markdown("### Results Archive")
+    archive_results = st.checkbox("Archive Results", value=False,
+                                  help="Append every analysis to a local Parquet archive, partitioned by country, "
+                                       "admin level, year and analysis type, to compare runs over time")
 
 # Main content area
 col1, col2 = st.columns([2, 1])
@@ -1284,6 +3192,9 @@ with col1:
         if st.session_state.data_source == "Upload Custom Shapefile" and not st.session_state.use_custom_shapefile:
             st.error("Please upload all required shapefile components (.shp, .shx, .dbf)")
         else:
+            # A new analysis replaces the previous results, also if it fails
+            st.session_state.pop('analysis', None)
+            
             # Progress tracking
             progress_container = st.container()
             status_container = st.container()
@@ -1335,12 +3246,20 @@ with col1:
                     geom_types = gdf.geometry.type.unique()
                     st.info(f"Geometry types: {', '.join(geom_types)}")
                 
-                # Test WorldPop data availability
-                status_text.text("Testing WorldPop data availability...")
+                # Work out which WorldPop country rasters are needed
+                status_text.text("Matching boundaries to WorldPop countries...")
                 progress_bar.progress(30)
                 
-                test_url = construct_worldpop_url(st.session_state.country_code if st.session_state.data_source == "GADM Database" else "SLE", 
-                                                 year, age_group, sex)
+                if st.session_state.data_source == "Upload Custom Shapefile":
+                    country_matches = match_worldpop_countries(gdf)
+                    
+                    if not country_matches:
+                        st.error("The uploaded boundaries do not overlap any supported country. Check the coordinate system.")
+                        st.stop()
+                    
+                    matched_names = [name for code, _ in country_matches
+                                     for name, option_code in COUNTRY_OPTIONS.items() if option_code == code]
+                    st.info(f"Boundaries overlap: {', '.join(matched_names)}")
                 
                 # Step 2: Process WorldPop data for base year
                 status_text.text(f"Downloading WorldPop population data ({year} baseline)...")
@@ -1361,13 +3280,18 @@ with col1:
                             progress_callback=update_download_progress
                         )
                     else:
-                        # For custom shapefiles, need to specify a country code for WorldPop data
-                        st.warning("Custom shapefile detected. Using Sierra Leone (SLE) WorldPop data as default.")
-                        st.info("Tip: For accurate results with custom shapefiles, ensure they align with a specific country's boundaries")
-                        processed_gdf_base, used_url, file_size = process_worldpop_data(
-                            gdf, "SLE", year, age_group, sex,
-                            progress_callback=update_download_progress
+                        # For custom shapefiles, fetch only the intersecting part of each matched country
+                        def update_window_progress(done, total, code):
+                            download_status.info(f"Reading WorldPop window for {code} ({done}/{total} countries)")
+                        
+                        processed_gdf_base, used_urls, used_countries, file_size = process_worldpop_mosaic(
+                            gdf, country_matches, year, age_group, sex,
+                            progress_callback=update_window_progress
                         )
+                        used_url = "\n".join(used_urls)
+                        
+                        if len(used_countries) > 1:
+                            st.info(f"Mosaicked WorldPop data from {len(used_countries)} countries: {', '.join(used_countries)}")
                     
                     download_status.empty()  # Clear download progress
                     
@@ -1385,48 +3309,158 @@ with col1:
                     st.stop()
 
                 # Step 3: Generate projections if enabled
-                all_years_data = {year: processed_gdf_base}  # Start with selected base year
+                projected_data = None
                 
                 if enable_projection:
                     status_text.text(f"Generating population projections from {year} baseline...")
                     progress_bar.progress(60)
                     
-                    projected_data = project_population(processed_gdf_base, year, growth_rate, projection_years)
-                    all_years_data.update(projected_data)
+                    # National rate, per-unit rates from the uploaded table, or national scenarios
+                    projection_rates = growth_rate
+                    if projection_method == "Cohort-component (age/sex)":
+                        # Base-year age/sex structure from the 36 WorldPop cohort layers
+                        worldpop_source = (st.session_state.country_code
+                                           if st.session_state.data_source == "GADM Database" else country_matches)
+                        
+                        def update_cohort_progress(done, total, cohort_age, cohort_sex):
+                            download_status.info(f"Processing WorldPop age/sex layer {cohort_sex}_{cohort_age} ({done}/{total})")
+                        
+                        try:
+                            cohorts = process_age_sex_cohorts(gdf, worldpop_source, year,
+                                                              progress_callback=update_cohort_progress)
+                        except Exception as e:
+                            download_status.empty()
+                            st.error(f"Error processing age/sex layers: {str(e)}")
+                            st.stop()
+                        download_status.empty()
+                        
+                        start_cohorts = baseline_cohorts(processed_gdf_base, cohorts, age_group)
+                        processed_gdf_base = add_cohort_indicators(processed_gdf_base, start_cohorts)
+                        projected_data = project_cohort_components(
+                            processed_gdf_base, year, cohorts, projection_years, total_fertility,
+                            mortality_multiplier, migration_rate, age_group, sex
+                        )
+                    elif rate_source == "Fitted from WorldPop history":
+                        worldpop_source = (st.session_state.country_code
+                                           if st.session_state.data_source == "GADM Database" else country_matches)
+                        
+                        def update_fit_progress(done, total, hist_year):
+                            download_status.info(f"Processing WorldPop {hist_year} for growth fit ({done}/{total} years)")
+                        
+                        try:
+                            fit_years, _, fitted_rates = fit_historical_growth(
+                                gdf, boundary_cache_key(gdf), worldpop_source, year,
+                                GROWTH_FIT_WINDOWS[fit_window], age_group, sex,
+                                progress_callback=update_fit_progress
+                            )
+                        except Exception as e:
+                            download_status.empty()
+                            st.error(f"Error fitting growth rates: {str(e)}")
+                            st.stop()
+                        download_status.empty()
+                        
+                        projection_rates = np.where(np.isnan(fitted_rates), growth_rate, fitted_rates)
+                        unfitted_units = int(np.isnan(fitted_rates).sum())
+                        st.info(f"Growth rates fitted per unit from WorldPop {fit_years[0]}-{fit_years[-1]} "
+                                f"(median {np.nanmedian(fitted_rates) if unfitted_units < len(fitted_rates) else growth_rate:.2f}%/yr)")
+                        if unfitted_units:
+                            st.warning(f"{unfitted_units} unit(s) without population in every year use the national rate ({growth_rate}%)")
+                    elif rate_table is not None and rate_columns:
+                        projection_rates, rate_match_column, unmatched_units = match_growth_rates(
+                            processed_gdf_base, rate_table, rate_key_column, rate_columns, growth_rate
+                        )
+                        st.info(f"Per-unit growth rates joined on boundary attribute '{rate_match_column}'")
+                        if unmatched_units:
+                            st.warning(f"{unmatched_units} unit(s) not found in the rate table use the national rate ({growth_rate}%)")
+                    elif scenario_rates:
+                        projection_rates = scenario_rates
+                    
+                    if projected_data is None:
+                        projected_data = project_population(processed_gdf_base, year, projection_rates, projection_years)
+                    
+                    if enable_uncertainty:
+                        def update_uncertainty_progress(done, total):
+                            download_status.info(f"Sampling {num_draws:,} growth paths per unit (scenario {done}/{total})")
+                        
+                        projected_data = add_uncertainty_bands(projected_data, processed_gdf_base, rate_sd, annual_sd,
+                                                               num_draws, progress_callback=update_uncertainty_progress)
+                        download_status.empty()
+                        
+                        # The baseline is observed, so its bands collapse to the baseline total
+                        for band_column in band_columns():
+                            processed_gdf_base[band_column] = processed_gdf_base['total_population']
+                    
+                    if projection_method == "Cohort-component (age/sex)":
+                        implied_rate = float(np.mean(projected_data['growth_rates']))
+                        st.success(f"Cohort-component projection for {len(projected_data['years'])} years from {year} baseline "
+                                   f"(TFR {total_fertility}, implied growth {implied_rate:.2f}%/yr)")
+                    elif isinstance(projection_rates, dict):
+                        st.success(f"Population projected for {len(projected_data['years'])} years from {year} baseline "
+                                   f"for {len(projected_data['scenarios'])} scenario(s): {', '.join(projected_data['scenarios'])}")
+                    elif isinstance(projection_rates, np.ndarray):
+                        st.success(f"Population projected for {len(projected_data['years'])} years from {year} baseline using fitted per-unit growth rates")
+                    else:
+                        st.success(f"Population projected for {len(projected_data['years'])} years from {year} baseline using {growth_rate}% annual growth rate")
+                
+                # Scenarios × units × years matrix, baseline first; geometry stays on processed_gdf_base only
+                population = build_population_matrix(processed_gdf_base, year, projected_data,
+                                                      start_cohorts if projection_method == "Cohort-component (age/sex)" else None)
+                
+                # Optional calibration to national control totals
+                raked = False
+                if enable_raking and control_table is not None and control_total_column is not None:
+                    control_totals, cohort_margins = read_control_totals(control_table, control_year_column, control_total_column)
+                    
+                    if age_group != "ppp" and not (cohort_margins and 'cohorts' in population):
+                        # Without age/sex margins a single cohort can only be calibrated to its own
+                        # national total, never to the total population
+                        cohort_column = cohort_column_name(sex, age_group)
+                        if cohort_column in control_table.columns:
+                            control_total_column = cohort_column
+                            control_totals, _ = read_control_totals(control_table, control_year_column, cohort_column)
+                        else:
+                            control_totals = {}
+                            st.warning(f"Projections were not calibrated: age/sex analyses need a '{cohort_column}' "
+                                       f"column of national {age_group_name}, {sex_name} totals in the control table "
+                                       f"(or all age/sex columns with cohort-component projections)")
+                    matched_years = [y for y in population['years'] if y in control_totals]
                     
-                    st.success(f"Population projected for {len(projected_data)} years from {year} baseline using {growth_rate}% annual growth rate")
+                    if matched_years:
+                        population = rake_to_control_totals(
+                            population, control_totals, cohort_margins,
+                            None if age_group == "ppp" else cohort_index(sex, age_group)
+                        )
+                        raked = True
+                        
+                        if enable_uncertainty:
+                            projected_data['total_population_bands'] = (projected_data['total_population_bands'] *
+                                                                        population['raking_factors'][:, np.newaxis, 1:])
+                        
+                        ipf_note = " with age/sex margins" if cohort_margins and 'cohorts' in population else ""
+                        st.success(f"Calibrated {len(matched_years)} year(s) to national control totals{ipf_note}")
+                    elif control_totals:
+                        st.warning("No projection years found in the control totals table; projections were not calibrated")
+                
+                all_years = population['years']
+                scenarios = population['scenarios']
+                map_scenario_idx = scenarios.index(map_scenario) if map_scenario in scenarios else 0
                 
-                # Step 4: Generate visualizations for all years
-                status_text.text("Generating maps for all years...")
+                # Step 4: Prepare maps and downloads for all years
+                status_text.text("Preparing maps and downloads for all years...")
                 progress_bar.progress(80)
                 
-                # Create maps for each year
-                all_figures = {}
+                # Values and title of each year's map, in year order
+                map_years = []
+                map_tasks = []
                 
-                for proj_year in sorted(all_years_data.keys()):
-                    year_gdf = all_years_data[proj_year]
+                for proj_year in all_years:
+                    year_population = population['total_population'][map_scenario_idx, :, all_years.index(proj_year)]
                     
                     # Handle missing data
-                    if year_gdf['total_population'].sum() == 0:
+                    if year_population.sum() == 0:
                         st.error(f"No valid population data found for year {proj_year}")
                         continue
                     
-                    # Create visualization with white background for display
-                    fig, ax = plt.subplots(1, 1, figsize=(12, 10), facecolor='white')
-                    ax.set_facecolor('white')
-                    
-                    # Create the plot
-                    year_gdf.plot(
-                        column="total_population",
-                        ax=ax,
-                        legend=True,
-                        cmap=color_scheme,
-                        edgecolor="black",
-                        linewidth=0.5,
-                        legend_kwds={"shrink": 0.8, "label": "Population"},
-                        missing_kwds={"color": "#e5e5e5", "label": "No data"}
-                    )
-                    
                     if analysis_type == "Total Population":
                         if proj_year == year:
                             title = f"{st.session_state.country} - Total Population ({proj_year}) [Baseline]"
@@ -1438,296 +3472,166 @@ with col1:
                         else:
                             title = f"{st.session_state.country} - {age_group_name}, {sex_name} ({proj_year}) [Projected]"
                     
-                    ax.set_title(title, fontweight='bold', fontsize=14, color='black', pad=20)
-                    ax.set_axis_off()
+                    if len(scenarios) > 1 and proj_year != year:
+                        title += f" - {scenarios[map_scenario_idx]} scenario"
                     
-                    # Style the legend text to be black
-                    legend = ax.get_legend()
-                    if legend:
-                        # Set legend text color to black
-                        for text in legend.get_texts():
-                            text.set_color('black')
-                        # Set legend title color to black
-                        legend.get_title().set_color('black')
-                        # Set legend frame to match white theme
-                        frame = legend.get_frame()
-                        frame.set_facecolor('white')
-                        frame.set_edgecolor('black')
-                        frame.set_alpha(0.9)
-                    
-                    plt.tight_layout()
-                    all_figures[proj_year] = fig
-                
-                # Complete the analysis
-                progress_bar.progress(100)
-                status_text.text("Analysis complete!")
-                time.sleep(0.5)
-                status_text.empty()
-                
-                st.success(f"Population analysis completed successfully! Generated maps for {len(all_figures)} year(s)")
+                    map_years.append(proj_year)
+                    map_tasks.append((year_population, title))
                 
-                # Display all maps
-                st.markdown("## Population Maps")
+                # Create PDF filename
+                pdf_filename = f"worldpop_maps_{st.session_state.country_code}"
+                if enable_projection:
+                    pdf_filename += f"_{all_years[0]}-{all_years[-1]}"
+                else:
+                    pdf_filename += f"_{year}"
+                if analysis_type == "Age/Sex Disaggregated":
+                    pdf_filename += f"_{age_group}_{sex}"
+                pdf_filename += ".pdf"
                 
-                for proj_year in sorted(all_figures.keys()):
-                    st.markdown(f"### Year {proj_year}")
-                    st.pyplot(all_figures[proj_year])
+                # Long-format table of all scenarios and years
+                download_df = long_format_table(processed_gdf_base, population, year)
                 
-                # Add download all maps button (as PDF)
-                st.markdown("### Download All Maps")
+                # Values constant over the analysis; kept once per file (metadata sheet,
+                # GIS export metadata) rather than on every record, except in the CSV
+                export_constants = {
+                    'area_name': st.session_state.country,
+                    'data_source': st.session_state.data_source,
+                    'analysis_type': analysis_type,
+                    'base_year': year,
+                    'projection_enabled': enable_projection,
+                    'projection_years': projection_years if enable_projection else None,
+                }
+                if analysis_type == "Age/Sex Disaggregated":
+                    export_constants.update({'age_group': age_group_name, 'sex': sex_name})
+                if st.session_state.data_source == "GADM Database":
+                    export_constants.update({'country_code': st.session_state.country_code,
+                                             'admin_level': st.session_state.admin_level})
+                else:
+                    export_constants.update({'country_code': "CUSTOM", 'admin_level': "Custom",
+                                             'projection_source': "PRJ file provided" if prj_file else "Assumed WGS84"})
                 
-                col_pdf, col_images = st.columns(2)
+                filename_base = f"worldpop_population_{st.session_state.country_code}"
+                if enable_projection:
+                    filename_base += f"_{all_years[0]}-{all_years[-1]}"
+                else:
+                    filename_base += f"_{year}"
                 
-                with col_pdf:
-                    # Create PDF with all maps
-                    pdf_buffer = BytesIO()
-                    with PdfPages(pdf_buffer) as pdf:
-                        for proj_year in sorted(all_figures.keys()):
-                            pdf.savefig(all_figures[proj_year], dpi=300, bbox_inches='tight', facecolor='white')
-                    
-                    pdf_buffer.seek(0)
-                    
-                    # Create filename
-                    pdf_filename = f"worldpop_maps_{st.session_state.country_code}"
+                if st.session_state.data_source == "Upload Custom Shapefile":
+                    filename_base = f"worldpop_population_custom"
                     if enable_projection:
-                        pdf_filename += f"_{min(all_years_data.keys())}-{max(all_years_data.keys())}"
+                        filename_base += f"_{all_years[0]}-{all_years[-1]}"
                     else:
-                        pdf_filename += f"_{year}"
-                    if analysis_type == "Age/Sex Disaggregated":
-                        pdf_filename += f"_{age_group}_{sex}"
-                    pdf_filename += ".pdf"
-                    
-                    st.download_button(
-                        label=f"Download All Maps (PDF - {len(all_figures)} pages)",
-                        data=pdf_buffer,
-                        file_name=pdf_filename,
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
-                
-                with col_images:
-                    st.info(f"**PDF Contains**:\n- {len(all_figures)} high-resolution maps\n- White background\n- Black text & legend\n- Print-ready quality (300 DPI)")
-
-                # Show statistics if requested
-                if show_statistics:
-                    st.markdown("## Population Statistics")
-                    
-                    # Show stats for each year
-                    for proj_year in sorted(all_years_data.keys()):
-                        year_gdf = all_years_data[proj_year]
-                        
-                        st.markdown(f"### Year {proj_year} {' (Baseline)' if proj_year == year else ' (Projected)'}")
-                        
-                        col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
-                        
-                        with col_stat1:
-                            total = year_gdf['total_population'].sum()
-                            st.metric("Total Population", f"{total:,.0f}")
-                        
-                        with col_stat2:
-                            mean_pop = year_gdf['total_population'].mean()
-                            st.metric("Mean per Unit", f"{mean_pop:,.0f}")
-                        
-                        with col_stat3:
-                            max_pop = year_gdf['total_population'].max()
-                            st.metric("Maximum", f"{max_pop:,.0f}")
-                        
-                        with col_stat4:
-                            min_pop = year_gdf['total_population'].min()
-                            st.metric("Minimum", f"{min_pop:,.0f}")
-
-                # Data download section
-                st.markdown("## Download Data")
-                
-                # Prepare combined dataset for all years
-                all_years_combined = []
-                
-                for proj_year in sorted(all_years_data.keys()):
-                    year_gdf = all_years_data[proj_year].copy()
-                    year_gdf = year_gdf.drop(columns='geometry')
-                    year_gdf['year'] = proj_year
-                    year_gdf['is_baseline'] = (proj_year == year)
-                    year_gdf['is_projected'] = (proj_year != year)
-                    all_years_combined.append(year_gdf)
-                
-                download_df = pd.concat(all_years_combined, ignore_index=True)
-                
-                # Add metadata columns
-                download_df['area_name'] = st.session_state.country
-                download_df['data_source'] = st.session_state.data_source
-                download_df['analysis_type'] = analysis_type
-                download_df['base_year'] = year
-                
-                if enable_projection:
-                    download_df['projection_enabled'] = True
-                    download_df['growth_rate_percent'] = growth_rate
-                    download_df['projection_years'] = projection_years
-                else:
-                    download_df['projection_enabled'] = False
-                    download_df['growth_rate_percent'] = None
-                    download_df['projection_years'] = None
+                        filename_base += f"_{year}"
+                elif st.session_state.data_source == "GADM Database":
+                    filename_base = f"worldpop_population_{st.session_state.country_code}"
+                    if enable_projection:
+                        filename_base += f"_{all_years[0]}-{all_years[-1]}"
+                    else:
+                        filename_base += f"_{year}"
+                    filename_base += f"_admin{st.session_state.admin_level}"
                 
                 if analysis_type == "Age/Sex Disaggregated":
-                    download_df['age_group'] = age_group_name
-                    download_df['sex'] = sex_name
+                    filename_base += f"_{age_group}_{sex}"
                 
-                if st.session_state.data_source == "GADM Database":
-                    download_df['country_code'] = st.session_state.country_code
-                    download_df['admin_level'] = st.session_state.admin_level
-                else:
-                    download_df['country_code'] = "CUSTOM"
-                    download_df['admin_level'] = "Custom"
-                    if prj_file:
-                        download_df['projection_source'] = "PRJ file provided"
-                    else:
-                        download_df['projection_source'] = "Assumed WGS84"
+                # Summary statistics sheet (for all years)
+                summary_stats = summarize_years(
+                    population, year, projected_data['total_population_bands'] if enable_uncertainty else None
+                )
                 
-                # Reorder columns
-                column_order = ['area_name', 'data_source', 'base_year', 'year', 'is_baseline', 'is_projected', 
-                               'analysis_type', 'projection_enabled', 'growth_rate_percent', 'projection_years']
+                # Metadata sheet
+                metadata_values = [
+                    st.session_state.country,
+                    st.session_state.data_source,
+                    st.session_state.country_code,
+                    str(st.session_state.admin_level) if st.session_state.data_source == "GADM Database" else "Custom",
+                    year,
+                    "Yes" if enable_projection else "No",
+                    (f"Cohort-component (TFR {total_fertility}, mortality ×{mortality_multiplier}, migration {migration_rate}%/yr)"
+                     if projection_method == "Cohort-component (age/sex)" else
+                     describe_growth_rates(growth_rate, rate_columns if rate_table is not None else [], scenario_rates,
+                                           fit_years if rate_source == "Fitted from WorldPop history" else None)) if enable_projection else "N/A",
+                    f"{projection_years} years" if enable_projection else "N/A",
+                    ', '.join(map(str, all_years)),
+                    analysis_type,
+                    'WorldPop Unconstrained',
+                    'GADM v4.1' if st.session_state.data_source == "GADM Database" else 'User Upload',
+                    datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    len(download_df),
+                    'WorldPop Population Analysis Tool v2.0'
+                ]
                 
-                if analysis_type == "Age/Sex Disaggregated":
-                    column_order.extend(['age_group', 'sex'])
+                metadata_params = [
+                    'Area Name', 'Data Source', 'Country Code', 'Admin Level', 'Base Year',
+                    'Projection Enabled', 'Growth Rate', 'Projection Period', 'Years Included',
+                    'Analysis Type', 'Population Source', 'Boundary Source', 'Generated On',
+                    'Total Records', 'Tool Version'
+                ]
                 
-                if st.session_state.data_source == "GADM Database":
-                    column_order.extend(['country_code', 'admin_level'])
-                else:
-                    column_order.extend(['country_code', 'admin_level', 'projection_source'])
+                if analysis_type == "Age/Sex Disaggregated":
+                    metadata_values.extend([age_group_name, sex_name])
+                    metadata_params.extend(['Age Group', 'Sex'])
                 
-                # Add name columns
-                name_cols = [col for col in download_df.columns if col.startswith('NAME_')]
-                column_order.extend(sorted(name_cols))
+                if raked:
+                    metadata_values.append(f"Raked to '{control_total_column}' from {control_file.name}"
+                                           + (" (IPF with age/sex margins)" if 'cohorts' in population and cohort_margins else ""))
+                    metadata_params.append('Control Totals')
                 
-                # Add population columns
-                column_order.extend(['total_population', 'mean_density', 'valid_pixels'])
+                if enable_uncertainty:
+                    metadata_values.append(f"P{'/P'.join(map(str, UNCERTAINTY_PERCENTILES))} from {num_draws:,} draws "
+                                           f"(rate SD {rate_sd}%, annual SD {annual_sd}%)")
+                    metadata_params.append('Uncertainty Bands')
                 
-                # Add remaining columns
-                remaining_cols = [col for col in download_df.columns if col not in column_order]
-                column_order.extend(remaining_cols)
+                if st.session_state.data_source == "Upload Custom Shapefile":
+                    metadata_values.extend([
+                        crs_source if 'crs_source' in locals() else "Unknown",
+                        "Yes" if prj_file else "No"
+                    ])
+                    metadata_params.extend(['Coordinate System', 'PRJ File Included'])
                 
-                # Reorder
-                available_cols = [col for col in column_order if col in download_df.columns]
-                download_df = download_df[available_cols]
+                metadata = pd.DataFrame({
+                    'Parameter': metadata_params,
+                    'Value': metadata_values
+                })
                 
-                # Create download buttons
-                col_csv, col_excel = st.columns(2)
+                # Keep the results, so reruns (downloads, display option changes) do not repeat the analysis
+                st.session_state.analysis = {
+                    'units_gdf': processed_gdf_base,
+                    'boundary_key': boundary_cache_key(processed_gdf_base),
+                    'map_years': map_years,
+                    'map_tasks': map_tasks,
+                    'pdf_filename': pdf_filename,
+                    'population': population,
+                    'base_year': year,
+                    'scenarios': scenarios,
+                    'map_scenario_idx': map_scenario_idx,
+                    'total_population_bands': projected_data['total_population_bands'] if enable_uncertainty else None,
+                    'download_df': download_df,
+                    'filename_base': filename_base,
+                    'summary_stats': summary_stats,
+                    'metadata': metadata,
+                    'export_constants': export_constants,
+                    'export_key': export_cache_key(download_df, metadata),
+                    'archive_partition': {
+                        'country': str(export_constants['country_code']),
+                        'admin_level': str(export_constants['admin_level']),
+                        'analysis_type': "total" if analysis_type == "Total Population" else cohort_column_name(sex, age_group),
+                    },
+                }
                 
-                with col_csv:
-                    csv_data = download_df.to_csv(index=False)
-                    filename_base = f"worldpop_population_{st.session_state.country_code}"
-                    if enable_projection:
-                        filename_base += f"_{min(all_years_data.keys())}-{max(all_years_data.keys())}"
-                    else:
-                        filename_base += f"_{year}"
-                    
-                    if st.session_state.data_source == "Upload Custom Shapefile":
-                        filename_base = f"worldpop_population_custom"
-                        if enable_projection:
-                            filename_base += f"_{min(all_years_data.keys())}-{max(all_years_data.keys())}"
-                        else:
-                            filename_base += f"_{year}"
-                    elif st.session_state.data_source == "GADM Database":
-                        filename_base = f"worldpop_population_{st.session_state.country_code}"
-                        if enable_projection:
-                            filename_base += f"_{min(all_years_data.keys())}-{max(all_years_data.keys())}"
-                        else:
-                            filename_base += f"_{year}"
-                        filename_base += f"_admin{st.session_state.admin_level}"
-                    
-                    if analysis_type == "Age/Sex Disaggregated":
-                        filename_base += f"_{age_group}_{sex}"
-                    
-                    st.download_button(
-                        label="Download as CSV",
-                        data=csv_data,
-                        file_name=f"{filename_base}.csv",
-                        mime="text/csv",
-                        use_container_width=True
-                    )
+                if archive_results:
+                    try:
+                        archive_entry = archive_analysis(st.session_state.analysis)
+                        st.info(f"Results archived as run {archive_entry['run_id']}")
+                    except Exception as e:
+                        st.warning(f"Could not archive results: {str(e)}")
                 
-                with col_excel:
-                    # Create Excel file in memory
-                    excel_buffer = BytesIO()
-                    
-                    with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-                        # Main data sheet
-                        download_df.to_excel(writer, sheet_name='Population_Data', index=False)
-                        
-                        # Summary statistics sheet (for all years)
-                        summary_data = []
-                        for proj_year in sorted(all_years_data.keys()):
-                            year_data = download_df[download_df['year'] == proj_year]
-                            summary_data.append({
-                                'Year': proj_year,
-                                'Type': 'Baseline' if proj_year == year else 'Projected',
-                                'Total Population': f"{year_data['total_population'].sum():,.0f}",
-                                'Mean per Unit': f"{year_data['total_population'].mean():,.0f}",
-                                'Std Dev': f"{year_data['total_population'].std():,.0f}",
-                                'Minimum': f"{year_data['total_population'].min():,.0f}",
-                                'Maximum': f"{year_data['total_population'].max():,.0f}",
-                                'Units Analyzed': len(year_data)
-                            })
-                        
-                        summary_stats = pd.DataFrame(summary_data)
-                        summary_stats.to_excel(writer, sheet_name='Summary_Stats', index=False)
-                        
-                        # Metadata sheet
-                        metadata_values = [
-                            st.session_state.country,
-                            st.session_state.data_source,
-                            st.session_state.country_code,
-                            str(st.session_state.admin_level) if st.session_state.data_source == "GADM Database" else "Custom",
-                            year,
-                            "Yes" if enable_projection else "No",
-                            f"{growth_rate}%" if enable_projection else "N/A",
-                            f"{projection_years} years" if enable_projection else "N/A",
-                            ', '.join(map(str, sorted(all_years_data.keys()))),
-                            analysis_type,
-                            'WorldPop Unconstrained',
-                            'GADM v4.1' if st.session_state.data_source == "GADM Database" else 'User Upload',
-                            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                            len(download_df),
-                            'WorldPop Population Analysis Tool v2.0'
-                        ]
-                        
-                        metadata_params = [
-                            'Area Name', 'Data Source', 'Country Code', 'Admin Level', 'Base Year',
-                            'Projection Enabled', 'Growth Rate', 'Projection Period', 'Years Included',
-                            'Analysis Type', 'Population Source', 'Boundary Source', 'Generated On',
-                            'Total Records', 'Tool Version'
-                        ]
-                        
-                        if analysis_type == "Age/Sex Disaggregated":
-                            metadata_values.extend([age_group_name, sex_name])
-                            metadata_params.extend(['Age Group', 'Sex'])
-                        
-                        if st.session_state.data_source == "Upload Custom Shapefile":
-                            metadata_values.extend([
-                                crs_source if 'crs_source' in locals() else "Unknown",
-                                "Yes" if prj_file else "No"
-                            ])
-                            metadata_params.extend(['Coordinate System', 'PRJ File Included'])
-                        
-                        metadata = pd.DataFrame({
-                            'Parameter': metadata_params,
-                            'Value': metadata_values
-                        })
-                        metadata.to_excel(writer, sheet_name='Metadata', index=False)
-                    
-                    excel_buffer.seek(0)
-                    
-                    st.download_button(
-                        label="Download as Excel",
-                        data=excel_buffer.getvalue(),
-                        file_name=f"{filename_base}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True
-                    )
+                # Complete the analysis
+                progress_bar.progress(100)
+                status_text.text("Analysis complete!")
+                time.sleep(0.5)
+                status_text.empty()
                 
-                # Show data preview
-                with st.expander("Preview Downloaded Data"):
-                    st.dataframe(download_df.head(20), use_container_width=True)
-                    st.caption(f"Showing first 20 rows of {len(download_df)} total records ({len(all_years_data)} years × {len(all_years_data[year])} units)")
+                st.success(f"Population analysis completed successfully! Generated maps for {len(map_tasks)} year(s)")
 
             except Exception as e:
                 st.error(f"Unexpected error: {str(e)}")
@@ -1743,11 +3647,205 @@ with col1:
                     st.write(f"Analysis Type: {analysis_type}")
                     st.write(f"Projection Enabled: {enable_projection}")
                     if enable_projection:
+                        st.write(f"Projection Method: {projection_method}")
                         st.write(f"Growth Rate: {growth_rate}%")
                         st.write(f"Projection Years: {projection_years}")
                     if analysis_type == "Age/Sex Disaggregated":
                         st.write(f"Age Group: {age_group_name}")
                         st.write(f"Sex: {sex_name}")
+    
+    # Results of the last analysis stay on screen across reruns (downloads, display option
+    # changes); maps are only redrawn when they are missing from the render cache
+    if 'analysis' in st.session_state:
+        analysis = st.session_state.analysis
+        population = analysis['population']
+        base_year = analysis['base_year']
+        all_years = population['years']
+        scenarios = analysis['scenarios']
+        map_scenario_idx = analysis['map_scenario_idx']
+        download_df = analysis['download_df']
+        
+        map_years = analysis['map_years']
+        # Class breaks over every mapped year, so all maps share the same classes
+        map_breaks = None
+        if classification != "Continuous":
+            map_breaks = classify_breaks(np.concatenate([values for values, _ in analysis['map_tasks']]),
+                                         classification, num_classes)
+        map_style = (render_mode, show_boundaries, map_breaks)
+        lazy_maps = map_display == "Selected year" and len(map_years) > 1
+        
+        st.markdown("## Population Maps")
+        
+        if lazy_maps:
+            # Only the picked year is rendered, so the first map takes the same time
+            # however many projection years there are
+            selected_year = st.select_slider("Map Year", options=map_years, value=map_years[0])
+            shown_years = [selected_year]
+        else:
+            shown_years = map_years
+        
+        try:
+            with st.spinner("Rendering maps..."):
+                map_images = cached_map_renders(
+                    analysis['units_gdf'], analysis['boundary_key'], map_years, analysis['map_tasks'],
+                    color_scheme, map_style, years=shown_years
+                )
+        except Exception as e:
+            st.error(f"Error rendering maps: {str(e)}")
+            map_images = {}
+        
+        # Display maps
+        for proj_year in sorted(map_images.keys()):
+            st.markdown(f"### Year {proj_year}")
+            st.image(map_images[proj_year])
+        
+        # Add download all maps button (as PDF)
+        st.markdown("### Download All Maps")
+        
+        col_pdf, col_images = st.columns(2)
+        
+        with col_pdf:
+            # Assembled from the rendered maps only when asked for; years not yet on
+            # screen are rendered first
+            _, pdf_key = map_cache_keys(analysis['boundary_key'], map_years, analysis['map_tasks'],
+                                        color_scheme, map_style)
+            pdf_path = find_export(pdf_key, "pdf") if map_images else None
+            if map_images and pdf_path is None and st.button("Prepare PDF", use_container_width=True):
+                try:
+                    with st.spinner(f"Preparing the PDF of all {len(map_years)} maps..."):
+                        pdf_path = prepare_maps_pdf(
+                            analysis['units_gdf'], analysis['boundary_key'], map_years, analysis['map_tasks'],
+                            color_scheme, map_style
+                        )
+                except Exception as e:
+                    st.error(f"Error preparing PDF: {str(e)}")
+            
+            if pdf_path is not None:
+                export_download_link(pdf_path, f"Download All Maps (PDF - {len(map_years)} pages)",
+                                     analysis['pdf_filename'])
+        
+        with col_images:
+            # Per-year PNG maps; with on-demand maps most years are still to be drawn,
+            # so the archive is only built when asked for
+            zip_folder = os.path.splitext(analysis['pdf_filename'])[0]
+            if map_images and (not lazy_maps or st.button("Prepare PNG Maps (ZIP)", use_container_width=True)):
+                try:
+                    with st.spinner("Packing PNG maps..."):
+                        zip_path = prepare_maps_zip(
+                            analysis['units_gdf'], analysis['boundary_key'], map_years, analysis['map_tasks'],
+                            color_scheme, map_style, zip_folder
+                        )
+                    export_download_link(zip_path, f"Download All Maps (PNG - {len(map_years)} images)",
+                                         f"{zip_folder}.zip")
+                except Exception as e:
+                    st.error(f"Error packing PNG maps: {str(e)}")
+            
+            st.info(f"**PDF Contains**:\n- {len(map_years)} high-resolution maps\n- White background\n- Black text & legend\n- {MAP_DPI} DPI resolution")
+        
+        if len(map_years) > 1:
+            # Time-lapse of all mapped years, drawn only when asked for
+            st.markdown("### Download Animation")
+            col_format, col_animation = st.columns(2)
+            
+            with col_format:
+                animation_format = st.radio("Animation Format", available_animation_formats(), horizontal=True)
+            
+            with col_animation:
+                if st.button("Prepare Animation", use_container_width=True):
+                    try:
+                        with st.spinner(f"Rendering {len(map_years)} animation frames..."):
+                            animation_path = prepare_maps_animation(
+                                analysis['units_gdf'], analysis['boundary_key'], map_years, analysis['map_tasks'],
+                                color_scheme, map_style, animation_format
+                            )
+                        export_download_link(animation_path,
+                                             f"Download Animation ({animation_format} - {len(map_years)} frames)",
+                                             f"{zip_folder}.{animation_format.lower()}")
+                    except Exception as e:
+                        st.error(f"Error rendering animation: {str(e)}")
+
+        # Show statistics if requested
+        if show_statistics:
+            st.markdown("## Population Statistics")
+            
+            if len(scenarios) > 1:
+                st.markdown("### Scenario Comparison (Total Population)")
+                scenario_totals = pd.DataFrame(
+                    population['total_population'].sum(axis=1).T,
+                    index=pd.Index(all_years, name='Year'),
+                    columns=scenarios
+                )
+                st.dataframe(scenario_totals.style.format("{:,.0f}"), use_container_width=True)
+                st.caption(f"Per-year statistics below are for the {scenarios[map_scenario_idx]} scenario")
+            
+            # Show stats for each year
+            for year_idx, proj_year in enumerate(all_years):
+                year_population = population['total_population'][map_scenario_idx, :, year_idx]
+                
+                st.markdown(f"### Year {proj_year} {' (Baseline)' if proj_year == base_year else ' (Projected)'}")
+                
+                col_stat1, col_stat2, col_stat3, col_stat4 = st.columns(4)
+                
+                with col_stat1:
+                    total = year_population.sum()
+                    st.metric("Total Population", f"{total:,.0f}")
+                    if analysis['total_population_bands'] is not None and proj_year != base_year:
+                        total_bands = analysis['total_population_bands'][map_scenario_idx, :, year_idx - 1]
+                        st.caption(f"{UNCERTAINTY_PERCENTILES[0]}-{UNCERTAINTY_PERCENTILES[-1]}th percentile: "
+                                   f"{total_bands[0]:,.0f} – {total_bands[-1]:,.0f}")
+                
+                with col_stat2:
+                    mean_pop = year_population.mean()
+                    st.metric("Mean per Unit", f"{mean_pop:,.0f}")
+                
+                with col_stat3:
+                    max_pop = year_population.max()
+                    st.metric("Maximum", f"{max_pop:,.0f}")
+                
+                with col_stat4:
+                    min_pop = year_population.min()
+                    st.metric("Minimum", f"{min_pop:,.0f}")
+
+        # Data download section
+        st.markdown("## Download Data")
+        
+        # Exports are serialized to disk only when asked for, then kept for re-download
+        export_columns = st.columns(2) + st.columns(2)
+        
+        for column, (export_format, extension) in zip(export_columns, DATA_EXPORT_FORMATS.items()):
+            with column:
+                prepared_path = find_export(data_export_key(analysis, export_format), extension)
+                if prepared_path is not None or st.button(f"Prepare {export_format}", use_container_width=True):
+                    try:
+                        with st.spinner(f"Preparing {export_format} file..."):
+                            prepared_path = prepare_data_export(analysis, export_format)
+                        export_download_link(prepared_path, f"Download as {export_format}",
+                                             f"{analysis['filename_base']}.{extension}")
+                    except Exception as e:
+                        st.error(f"Error preparing {export_format} file: {str(e)}")
+        
+        # Totals of this country, admin level and analysis type in every archived run
+        if archive_results:
+            partition = analysis['archive_partition']
+            try:
+                archived = query_archive(columns=['run_id', 'scenario', 'year', 'total_population'], **partition)
+            except Exception as e:
+                archived = None
+                st.warning(f"Could not read the results archive: {str(e)}")
+            
+            if archived is not None and len(archived):
+                st.markdown("## Archived Runs")
+                run_totals = archived.pivot_table(index='year', columns=['run_id', 'scenario'],
+                                                  values='total_population', aggfunc='sum')
+                run_totals.columns = [f"{run_id} ({scenario})" for run_id, scenario in run_totals.columns]
+                st.dataframe(run_totals.style.format("{:,.0f}", na_rep=""), use_container_width=True)
+                st.caption(f"Total population by year in {run_totals.shape[1]} archived run(s) for "
+                           f"{partition['country']}, admin level {partition['admin_level']} ({partition['analysis_type']})")
+        
+        # Show data preview
+        with st.expander("Preview Downloaded Data"):
+            st.dataframe(download_df.head(20), use_container_width=True)
+            st.caption(f"Showing first 20 rows of {len(download_df)} total records ({len(all_years)} years × {len(analysis['units_gdf'])} units)")
 
 with col2:
     st.markdown("## About This Tool")
@@ -1823,6 +3921,12 @@ with col2:
         - Select ANY year 2000-2020 as your baseline
         - Applies compound growth formula from that baseline
         - Projects forward (positive rate) or backward (negative rate)
+        - Optional per-unit rates from an uploaded table (e.g. district rates)
+        - Or fit each unit's rate to its last 5 or 10 WorldPop years (log-linear trend)
+        - Optional Monte Carlo uncertainty bands (5th/50th/95th percentiles) per unit
+        - Optional calibration (raking) to uploaded national totals by year
+        - Compare low/medium/high scenarios side by side
+        - Cohort-component mode ages the 36 WorldPop age/sex layers forward with fertility, mortality and migration, and adds under-5 and women 15-49 projections
         
         **Growth Rate Examples:**
         - **2.5%**: Average African population growth
@@ -1916,6 +4020,12 @@ with col2:
         - All years in single file
         - Ready for GIS/analysis tools
         
+        **GeoParquet / GeoPackage Download:**
+        - Unit boundaries included (no re-joining by name)
+        - One row per unit, one column per year
+        - Spatial index for fast area queries
+        - Analysis parameters stored once per file
+        
         **Excel Download:**
         - Population data sheet (all years)
         - Summary statistics by year
@@ -1934,7 +4044,7 @@ with col2:
         st.markdown("""
         - **No data**: Try different year/age group
         - **Slow loading**: Normal for large countries
-        - **Custom shapefile**: Requires country selection
+        - **Custom shapefile**: WorldPop countries are detected from its extent
         - **Projection errors**: Check growth rate input
         - **Missing areas**: Check admin level
         - **Large downloads**: Try higher admin levels
@@ -2,19 +2,32 @@ import streamlit as st
 import geopandas as gpd
 import rasterio
 import rasterio.mask
+import rasterio.features
+import rasterio.transform
+from rasterio.windows import Window
 import requests
 import tempfile
 import os
 import zipfile
 import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
 from io import BytesIO
 from matplotlib import pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from datetime import datetime
 import time
+import math
+import json
+import hashlib
+import shutil
+import struct
+import zlib
+import streamlit.components.v1 as components
+from matplotlib.colors import LinearSegmentedColormap
 from shapely.geometry import Point, MultiPolygon
 import warnings
+import threading
 warnings.filterwarnings('ignore')
 
 # Set page config
@@ -210,6 +223,41 @@ COUNTRY_OPTIONS = {
 
 WORLDPOP_CODES = {code: code.lower() for code in COUNTRY_OPTIONS.values()}
 
+# Map layer colours (shared by the static maps and the interactive tiles)
+ACCESS_WITHIN_COLORS = ['#e0f2fe', '#bae6fd', '#7dd3fc', '#38bdf8', '#0ea5e9', '#0284c7', '#0369a1']
+ACCESS_BEYOND_COLORS = ['#fef2f2', '#fecaca', '#fca5a5', '#f87171', '#ef4444', '#dc2626', '#b91c1c']
+POPULATION_COLORS = ['#fefce8', '#fef08a', '#fde047', '#facc15', '#f59e0b', '#d97706', '#92400e']
+
+# Interactive map tiles, served by Streamlit from static/ (server.enableStaticServing)
+TILE_SIZE = 256
+TILE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "tiles")
+TILE_URL = "app/static/tiles"
+TILE_MAX_ZOOM = 12  # never render tiles finer than this, whatever the raster resolution
+TILE_BUDGET = 20000  # tiles per layer; the finest zoom levels are dropped above this
+TILE_PREVIEW_BUDGET = 500  # tiles per layer rendered before the map is shown; finer levels follow in the background
+TILE_POLL_SECONDS = 5  # how often an open map checks for newly rendered zoom levels
+TILE_SETS_KEPT = 10  # rendered analyses kept on disk
+TILE_KEEP_SECONDS = 600  # tile sets used this recently are never dropped, however many there are
+MAP_VIEWS = ["Interactive (tiles)", "Static"]
+
+# Static access maps: figure size (inches), PDF resolution, and the screen resolution
+# overview grids are sized to (about one grid cell per figure pixel)
+ACCESS_MAP_FIGSIZE = (12, 10)
+ACCESS_MAP_DPI = 300
+ACCESS_OVERVIEW_DPI = 100
+
+# Quantile sketches: log-spaced bins with this relative accuracy over a fixed value range,
+# so sketches of any blocks can be merged by adding their counts
+SKETCH_ACCURACY = 0.01
+SKETCH_RANGE = (1e-6, 1e12)
+RASTER_READ_ROWS = 1024  # rows per block when reading population rasters
+RASTER_CACHE_ENTRIES = 2  # country-years kept in memory (a national raster can take about 1 GB)
+
+# Maps drawn directly from value grids (without matplotlib)
+MAP_IMAGE_MIN_SIZE = 800  # small grids are enlarged to at least this many pixels along the longer side
+MAP_LAYER_ALPHA = 0.7  # population colours over white, as in the PDF maps
+MAP_BOUNDARY_COLOR = '#4d4d4d'  # black boundary lines at 70 % over white
+
 # Initialize session state
 if 'facilities_df' not in st.session_state:
     st.session_state.facilities_df = None
@@ -220,9 +268,8 @@ if 'boundary_source' not in st.session_state:
 if 'custom_boundaries' not in st.session_state:
     st.session_state.custom_boundaries = None
 
-@st.cache_data
-def download_worldpop_data(country_code, year):
-    """Download WorldPop data"""
+def download_worldpop_data(country_code, year, output):
+    """Download WorldPop data to a binary file, a chunk at a time; returns the URL used"""
     country_lower = WORLDPOP_CODES[country_code]
     
     # Try multiple URL patterns as WorldPop structure varies by year
@@ -243,12 +290,14 @@ def download_worldpop_data(country_code, year):
             response = requests.get(url, timeout=180, stream=True)
             response.raise_for_status()
             
-            chunks = []
+            output.seek(0)
+            output.truncate()
             for chunk in response.iter_content(chunk_size=1024*1024):
                 if chunk:
-                    chunks.append(chunk)
+                    output.write(chunk)
             
-            return b''.join(chunks), url
+            output.flush()
+            return url
         except Exception as e:
             last_error = e
             continue
@@ -411,55 +460,37 @@ def load_custom_shapefile(shp_file, shx_file, dbf_file, prj_file=None):
     
     return gdf
 
-def create_distance_raster_optimized(pop_raster_array, facilities_gdf, transform, crs, chunk_size=500):
-    """Create distance raster from facilities using chunked processing for memory efficiency"""
+def create_distance_raster_optimized(pop_raster_array, facilities_gdf, transform, crs, chunk_pixels=1_000_000):
+    """
+    Create distance raster (metres) to the nearest facility with a KD-tree.
+    
+    The facilities go into a cKDTree in degrees and pixel centres are queried a strip of
+    rows at a time (about chunk_pixels pixels), so the cost grows with
+    pixels × log(facilities) rather than pixels × facilities. Degrees are converted to
+    metres at each pixel's latitude (111,320 m × cos(latitude)), a factor that does not
+    depend on the facility, so the nearest facility in degrees is also the nearest in metres.
+    """
     height, width = pop_raster_array.shape
-    
-    # Initialize distance array with large values
     min_distances = np.full((height, width), np.inf, dtype=np.float32)
+    if len(facilities_gdf) == 0:
+        return min_distances
     
-    # Process in chunks to save memory
-    for i in range(0, height, chunk_size):
-        for j in range(0, width, chunk_size):
-            # Define chunk bounds
-            i_end = min(i + chunk_size, height)
-            j_end = min(j + chunk_size, width)
-            
-            # Get pixel coordinates for this chunk
-            rows, cols = np.meshgrid(
-                np.arange(i, i_end), 
-                np.arange(j, j_end), 
-                indexing='ij'
-            )
-            
-            # Convert pixel coordinates to geographic coordinates
-            xs, ys = rasterio.transform.xy(transform, rows.flatten(), cols.flatten())
-            xs = np.array(xs).reshape(rows.shape)
-            ys = np.array(ys).reshape(rows.shape)
-            
-            # Calculate distance to each facility for this chunk
-            chunk_min_dist = np.full(rows.shape, np.inf, dtype=np.float32)
-            
-            for idx, facility in facilities_gdf.iterrows():
-                facility_x = facility.geometry.x
-                facility_y = facility.geometry.y
-                
-                # Calculate Euclidean distance in degrees
-                dx = xs - facility_x
-                dy = ys - facility_y
-                distances_deg = np.sqrt(dx**2 + dy**2)
-                
-                # Convert to meters (approximate)
-                # At equator: 1 degree ≈ 111,320 meters
-                # Adjust for latitude: meters = degrees * 111320 * cos(latitude)
-                lat_rad = np.radians(ys)
-                distances_m = distances_deg * 111320 * np.cos(lat_rad)
-                
-                # Keep minimum distance
-                chunk_min_dist = np.minimum(chunk_min_dist, distances_m)
-            
-            # Store chunk result
-            min_distances[i:i_end, j:j_end] = chunk_min_dist
+    tree = cKDTree(np.column_stack([facilities_gdf.geometry.x, facilities_gdf.geometry.y]))
+    
+    strip_rows = max(1, chunk_pixels // width)
+    col_centres = np.arange(width) + 0.5
+    
+    for i in range(0, height, strip_rows):
+        i_end = min(i + strip_rows, height)
+        row_centres = np.arange(i, i_end)[:, np.newaxis] + 0.5
+        
+        # Pixel centres of the strip, as rasterio.transform.xy computes them
+        xs = transform.a * col_centres + transform.b * row_centres + transform.c
+        ys = transform.d * col_centres + transform.e * row_centres + transform.f
+        
+        distances_deg, _ = tree.query(np.column_stack([xs.ravel(), ys.ravel()]), workers=-1)
+        distances_m = distances_deg.reshape(xs.shape) * 111320 * np.cos(np.radians(ys))
+        min_distances[i:i_end] = distances_m
     
     return min_distances
 
@@ -522,6 +553,627 @@ def calculate_distance_bands(pop_raster_array, distance_raster, nodata_value):
     
     return pd.DataFrame(results)
 
+def new_quantile_sketch():
+    """
+    Empty mergeable quantile sketch for positive values.
+    
+    Values fall into log-spaced bins (bin i holds (gamma^(i-1), gamma^i] relative to the
+    range minimum), so any quantile is known to within SKETCH_ACCURACY relative error.
+    The bins are the same for every sketch, which makes merging an addition of counts.
+    """
+    gamma = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+    num_bins = int(math.ceil(math.log(SKETCH_RANGE[1] / SKETCH_RANGE[0]) / math.log(gamma))) + 1
+    return {'gamma': gamma, 'counts': np.zeros(num_bins, dtype=np.int64),
+            'count': 0, 'sum': 0.0, 'min': np.inf, 'max': -np.inf}
+
+def update_quantile_sketch(sketch, values):
+    """Add positive values (1-D array) to a quantile sketch in place"""
+    if values.size == 0:
+        return sketch
+    values = values.astype(np.float64, copy=False)
+    bins = np.ceil(np.log(np.clip(values, *SKETCH_RANGE) / SKETCH_RANGE[0]) / math.log(sketch['gamma']))
+    sketch['counts'] += np.bincount(bins.astype(np.int64), minlength=len(sketch['counts']))
+    sketch['count'] += values.size
+    sketch['sum'] += float(values.sum())
+    sketch['min'] = min(sketch['min'], float(values.min()))
+    sketch['max'] = max(sketch['max'], float(values.max()))
+    return sketch
+
+def merge_quantile_sketches(*sketches):
+    """New sketch of all values in the given sketches"""
+    merged = new_quantile_sketch()
+    for sketch in sketches:
+        merged['counts'] += sketch['counts']
+        merged['count'] += sketch['count']
+        merged['sum'] += sketch['sum']
+        merged['min'] = min(merged['min'], sketch['min'])
+        merged['max'] = max(merged['max'], sketch['max'])
+    return merged
+
+def sketch_quantile(sketch, q):
+    """Approximate q-quantile (0-1) of a sketch, None if it is empty"""
+    if sketch['count'] == 0:
+        return None
+    rank = q * (sketch['count'] - 1)
+    i = int(np.searchsorted(np.cumsum(sketch['counts']), rank, side='right'))
+    # Bin midpoint in relative terms, kept within the observed range
+    value = SKETCH_RANGE[0] * sketch['gamma'] ** i * 2 / (1 + sketch['gamma'])
+    return float(np.clip(value, sketch['min'], sketch['max']))
+
+@st.cache_resource(show_spinner=False, max_entries=RASTER_CACHE_ENTRIES)
+def read_population_raster(country_code, year):
+    """
+    Download and read a WorldPop raster block by block.
+    
+    A quantile sketch of the populated pixels is built while the blocks are read, so
+    display limits and distribution summaries need no extra pass; it is cached with the
+    raster for later runs. The download goes to a temporary file that is removed once
+    read, and the raster is cached as a shared resource rather than copied on every run,
+    so its array is read-only; only the RASTER_CACHE_ENTRIES most recent are kept.
+    
+    Returns:
+    - Dictionary with 'array', 'transform', 'crs', 'nodata', 'bounds', 'url' and 'sketch'
+    """
+    with tempfile.NamedTemporaryFile(suffix=".tif") as download:
+        pop_url = download_worldpop_data(country_code, year, download)
+        population_raster = read_raster_blocks(download.name)
+    population_raster['url'] = pop_url
+    return population_raster
+
+def read_raster_blocks(path):
+    """Read band 1 of a population raster RASTER_READ_ROWS rows at a time, with a quantile sketch of its populated pixels"""
+    with rasterio.open(path) as src:
+        nodata = src.nodata if src.nodata is not None else -99999
+        array = np.empty((src.height, src.width), dtype=src.dtypes[0])
+        sketch = new_quantile_sketch()
+        
+        for row in range(0, src.height, RASTER_READ_ROWS):
+            window = Window(0, row, src.width, min(RASTER_READ_ROWS, src.height - row))
+            block = src.read(1, window=window)
+            array[row:row + block.shape[0]] = block
+            update_quantile_sketch(sketch, block[(block != nodata) & ~np.isnan(block) & (block > 0)])
+        
+        array.flags.writeable = False
+        return {'array': array, 'transform': src.transform, 'crs': src.crs, 'nodata': nodata,
+                'bounds': src.bounds, 'sketch': sketch}
+
+def encode_png(indices, palette, alpha=None, compress_level=3):
+    """
+    PNG bytes of a palette image, written directly with zlib and struct.
+    
+    Parameters:
+    - indices: 2-D uint8 array of palette indices
+    - palette: (N, 3) uint8 RGB colours, N <= 256
+    - alpha: optional (N,) uint8 opacity per palette entry
+    - compress_level: zlib level (low levels encode much faster at slightly larger size)
+    """
+    height, width = indices.shape
+    
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    
+    # Each scanline starts with filter type 0 (none)
+    scanlines = np.zeros((height, width + 1), dtype=np.uint8)
+    scanlines[:, 1:] = indices
+    
+    png = b"\x89PNG\r\n\x1a\n"
+    png += chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+    png += chunk(b"PLTE", np.ascontiguousarray(palette, dtype=np.uint8).tobytes())
+    if alpha is not None:
+        png += chunk(b"tRNS", np.ascontiguousarray(alpha, dtype=np.uint8).tobytes())
+    png += chunk(b"IDAT", zlib.compress(scanlines.tobytes(), compress_level))
+    png += chunk(b"IEND", b"")
+    return png
+
+def hex_rgb(color):
+    """(r, g, b) uint8 values of a '#rrggbb' colour"""
+    return [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+
+def triangle_mask(size):
+    """Boolean mask of an upward triangle marker, size pixels high and wide"""
+    rows, cols = np.mgrid[0:size, 0:size]
+    return np.abs(cols - (size - 1) / 2) <= rows / 2 + 0.5
+
+def render_raster_map(grid, transform, colors, vmax, boundaries_gdf=None, points_gdf=None,
+                      marker_colors=('#dc2626', '#7f1d1d')):
+    """
+    PNG bytes of a raster map drawn directly from a value grid, without matplotlib.
+    
+    Values are binned into the steps of a colour lookup table (blended over white like
+    the PDF maps), and boundary lines and facility markers are burned into the same
+    palette image, so a map is one lookup and one PNG encode.
+    
+    Parameters:
+    - grid: 2-D values, NaN where nothing is shown
+    - transform: affine transform of the grid
+    - colors: hex colours of the colour ramp, from 0 to vmax
+    - vmax: value at the top of the ramp (higher values use the top colour)
+    - boundaries_gdf: polygons drawn as lines, in the CRS of the grid
+    - points_gdf: points drawn as triangle markers, in the CRS of the grid
+    - marker_colors: (fill, edge) colours of the markers
+    
+    Returns:
+    - PNG bytes
+    """
+    # Palette: 0 background, 1 boundaries, 2-3 marker fill and edge, then the colour ramp
+    ramp = LinearSegmentedColormap.from_list('ramp', colors)(np.linspace(0, 1, 252))[:, :3]
+    ramp = np.round((MAP_LAYER_ALPHA * ramp + (1 - MAP_LAYER_ALPHA)) * 255)
+    palette = np.vstack([
+        [[255, 255, 255], hex_rgb(MAP_BOUNDARY_COLOR), hex_rgb(marker_colors[0]), hex_rgb(marker_colors[1])],
+        ramp
+    ]).astype(np.uint8)
+    
+    # Small grids are enlarged by whole pixels, so lines and markers stay thin
+    scale = max(1, math.ceil(MAP_IMAGE_MIN_SIZE / max(grid.shape)))
+    shown = np.isfinite(grid)
+    steps = np.where(shown, 4 + np.clip(grid / vmax * 251, 0, 251), 0).astype(np.uint8)
+    if scale > 1:
+        steps = np.repeat(np.repeat(steps, scale, axis=0), scale, axis=1)
+        transform = transform * rasterio.transform.Affine.scale(1 / scale)
+    height, width = steps.shape
+    
+    if boundaries_gdf is not None and len(boundaries_gdf) > 0:
+        lines = rasterio.features.rasterize(
+            ((geom, 1) for geom in boundaries_gdf.geometry.boundary if geom is not None and not geom.is_empty),
+            out_shape=(height, width), transform=transform, fill=0, dtype=np.uint8
+        )
+        steps[lines == 1] = 1
+    
+    if points_gdf is not None and len(points_gdf) > 0:
+        cols, rows = ~transform * (points_gdf.geometry.x.values, points_gdf.geometry.y.values)
+        for index, size in ((3, 11), (2, 7)):
+            marker = triangle_mask(size)
+            offset_rows, offset_cols = np.nonzero(marker)
+            # Marker pixels around each point, clipped to the image
+            marker_rows = (np.floor(rows)[:, None] + offset_rows - size // 2).astype(np.int64).ravel()
+            marker_cols = (np.floor(cols)[:, None] + offset_cols - size // 2).astype(np.int64).ravel()
+            inside = (marker_rows >= 0) & (marker_rows < height) & (marker_cols >= 0) & (marker_cols < width)
+            steps[marker_rows[inside], marker_cols[inside]] = index
+    
+    return encode_png(steps, palette)
+
+def legend_html(colors, vmax, label):
+    """Lightweight colour legend strip (HTML) for a map drawn with render_raster_map"""
+    return f"""
+<div style='margin: 0.25rem 0 1.25rem 0;'>
+    <div style='height: 12px; border-radius: 3px; opacity: {MAP_LAYER_ALPHA};
+                background: linear-gradient(to right, {", ".join(colors)});'></div>
+    <div style='display: flex; justify-content: space-between; font-size: 0.8rem; color: #9ca3af;'>
+        <span>0</span><span>{label}</span><span>{vmax:,.0f}+</span>
+    </div>
+</div>
+"""
+
+def access_maps_pdf(maps, extent, colorbar_label, boundaries_gdf, facilities_gdf):
+    """
+    PDF bytes with one matplotlib page per access map; each figure is drawn, saved and
+    closed in turn.
+    
+    Parameters:
+    - maps: list of (overview grid, colormap, vmax or None, (marker colour, marker edge colour), title)
+    - extent: [west, east, south, north] of the overview grids
+    - colorbar_label: label of the grid values
+    - boundaries_gdf, facilities_gdf: boundaries and facilities in EPSG:4326
+    """
+    pdf_buffer = BytesIO()
+    with PdfPages(pdf_buffer) as pdf:
+        for grid, cmap, vmax, (marker_color, marker_edge_color), title in maps:
+            fig, ax = plt.subplots(1, 1, figsize=ACCESS_MAP_FIGSIZE, facecolor='white')
+            try:
+                ax.set_facecolor('white')
+                
+                # Plot admin boundaries
+                boundaries_gdf.boundary.plot(ax=ax, edgecolor='black', linewidth=0.5, alpha=0.7)
+                
+                # Plot population
+                if vmax is not None:
+                    im = ax.imshow(
+                        grid,
+                        extent=extent,
+                        cmap=cmap,
+                        alpha=0.7,
+                        interpolation='none',  # grid cells are embedded as they are, also in the PDF
+                        vmin=0,
+                        vmax=vmax
+                    )
+                    plt.colorbar(im, ax=ax, label=colorbar_label, shrink=0.7)
+                
+                # Plot facilities
+                facilities_gdf.plot(ax=ax, color=marker_color, markersize=30, marker='^',
+                                    edgecolor=marker_edge_color, linewidth=0.8, label='Health Facilities', zorder=5)
+                
+                ax.set_title(title, fontweight='bold', fontsize=13, color='black', pad=15)
+                ax.set_xlabel('Longitude', fontsize=10, color='black')
+                ax.set_ylabel('Latitude', fontsize=10, color='black')
+                ax.legend(loc='upper right', framealpha=0.9, edgecolor='black')
+                ax.tick_params(colors='black', labelsize=9)
+                ax.grid(True, alpha=0.2, linestyle='--', color='gray')
+                
+                fig.tight_layout()
+                pdf.savefig(fig, dpi=ACCESS_MAP_DPI, bbox_inches='tight', facecolor='white')
+            finally:
+                plt.close(fig)
+    
+    return pdf_buffer.getvalue()
+
+@st.fragment
+def maps_pdf_download(maps, extent, colorbar_label, boundaries_gdf, facilities_gdf, file_name):
+    """
+    Button that draws the access maps PDF (access_maps_pdf) and offers it for download.
+    A fragment, so the button reruns only this function and the results around it stay on screen.
+    """
+    if st.button("Prepare Maps (PDF)", use_container_width=True):
+        with st.spinner("Drawing map PDF..."):
+            pdf_bytes = access_maps_pdf(maps, extent, colorbar_label, boundaries_gdf, facilities_gdf)
+        st.download_button(
+            label=" Download Maps (PDF)",
+            data=pdf_bytes,
+            file_name=file_name,
+            mime="application/pdf",
+            use_container_width=True
+        )
+
+def overview_factor(shape, figsize=ACCESS_MAP_FIGSIZE, dpi=ACCESS_OVERVIEW_DPI):
+    """Block size (raster pixels per side) that brings a raster down to about a figure's pixel size"""
+    height, width = shape
+    return max(1, math.ceil(max(height / (figsize[1] * dpi), width / (figsize[0] * dpi))))
+
+def overview_sums(values, mask, factor, chunk_rows=256, sketch=None):
+    """
+    Sum-preserving overview grid: totals of values over mask in factor x factor blocks.
+    
+    The raster is processed in strips of block rows through one reused buffer, so no
+    full-size copy is made; partial blocks at the edges sum what they cover. The grid
+    total equals the masked raster total. If a quantile sketch is given, the positive
+    masked values are added to it in the same pass.
+    
+    Returns:
+    - Array of shape (ceil(height / factor), ceil(width / factor)), float64
+    """
+    height, width = values.shape
+    strip_rows = factor * max(1, chunk_rows // factor)
+    column_starts = np.arange(0, width, factor)
+    buffer = np.zeros((strip_rows, width), dtype=np.float32)
+    
+    strips = []
+    for start in range(0, height, strip_rows):
+        rows = min(strip_rows, height - start)
+        block_rows = math.ceil(rows / factor)
+        strip = buffer[:block_rows * factor]
+        np.multiply(values[start:start + rows], mask[start:start + rows], out=strip[:rows])
+        strip[rows:] = 0
+        
+        # Rows of each block first (contiguous), then columns on the smaller result
+        row_sums = strip.reshape(block_rows, factor, width).sum(axis=1)
+        if not np.isfinite(row_sums).all():
+            # NaN nodata outside the mask survives the multiplication
+            strip[~np.isfinite(strip)] = 0
+            row_sums = strip.reshape(block_rows, factor, width).sum(axis=1)
+        if sketch is not None:
+            strip_values = strip[:rows]
+            update_quantile_sketch(sketch, strip_values[strip_values > 0])
+        strips.append(np.add.reduceat(row_sums, column_starts, axis=1, dtype=np.float64))
+    
+    return np.vstack(strips)
+
+def tile_zoom_levels(bounds, pixel_size, budget=TILE_BUDGET):
+    """
+    Zoom levels to pre-render for a raster in geographic coordinates.
+    
+    The coarsest level shows the whole extent on about one tile; the finest is the level
+    whose tile pixels are closest to the raster pixels, lowered until the tile count fits
+    the budget (tiles per layer).
+    
+    Returns:
+    - (min zoom, max zoom)
+    """
+    west, south, east, north = bounds
+    extent = max(east - west, north - south)
+    min_zoom = max(0, int(math.floor(math.log2(360.0 / extent))))
+    max_zoom = max(min_zoom, min(TILE_MAX_ZOOM, int(round(math.log2(360.0 / (pixel_size * TILE_SIZE))))))
+    
+    while max_zoom > min_zoom:
+        num_tiles = sum(
+            (x1 - x0 + 1) * (y1 - y0 + 1)
+            for x0, x1, y0, y1 in (tile_range(bounds, z) for z in range(min_zoom, max_zoom + 1))
+        )
+        if num_tiles <= budget:
+            break
+        max_zoom -= 1
+    
+    return min_zoom, max_zoom
+
+def tile_range(bounds, zoom):
+    """XYZ tile columns and rows (x0, x1, y0, y1, inclusive) covering lon/lat bounds at a zoom level"""
+    west, south, east, north = bounds
+    n = 2 ** zoom
+    
+    def tile_y(lat):
+        lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+        return int((1 - math.log(math.tan(lat) + 1 / math.cos(lat)) / math.pi) / 2 * n)
+    
+    x0 = int((west + 180) / 360 * n)
+    x1 = min(int((east + 180) / 360 * n), n - 1)
+    return x0, x1, tile_y(north), min(tile_y(south), n - 1)
+
+def render_map_tiles(layers, transform, shape, tile_dir, min_zoom, max_zoom, progress=None):
+    """
+    Pre-render XYZ (web mercator) PNG tiles of raster layers.
+    
+    Each zoom level is processed one row of tiles at a time: the raster is sampled at the
+    tile pixel centres (nearest neighbour, separately per row and column since the raster
+    is in geographic coordinates), binned into colour steps and cut into tiles. Tiles are
+    palette PNGs (one byte per pixel, step 0 transparent), which encode several times
+    faster than RGBA. Tiles without data are not written, so Leaflet shows nothing there.
+    
+    Parameters:
+    - layers: dictionary layer name -> (values, mask of pixels to show, colormap, vmax)
+    - transform, shape: affine transform and (height, width) of the arrays
+    - tile_dir: output folder, tiles go to <tile_dir>/<layer>/<z>/<x>/<y>.png
+    - min_zoom, max_zoom: zoom levels to render
+    - progress: optional callback, called with the fraction done after each row of tiles
+    
+    Returns:
+    - Number of tiles written
+    """
+    height, width = shape
+    west = transform.c
+    north = transform.f
+    east = west + transform.a * width
+    south = north + transform.e * height
+    bounds = (west, south, east, north)
+    
+    # PNG palette and transparency per layer: transparent step 0, then 255 colour steps
+    palettes = {}
+    for name, (_, _, cmap, _) in layers.items():
+        colors = np.vstack([np.zeros((1, 4), dtype=np.uint8), cmap(np.linspace(0, 1, 255), bytes=True)])
+        palettes[name] = (colors[:, :3], colors[:, 3])
+    
+    num_tiles = 0
+    tile_rows = sum(y1 - y0 + 1 for _, _, y0, y1 in (tile_range(bounds, z) for z in range(min_zoom, max_zoom + 1)))
+    rows_done = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        x0, x1, y0, y1 = tile_range(bounds, zoom)
+        world_pixels = TILE_SIZE * 2 ** zoom
+        
+        # Raster columns of the tile pixel centres along this zoom level's strip
+        pixel_x = np.arange(x0 * TILE_SIZE, (x1 + 1) * TILE_SIZE) + 0.5
+        lons = pixel_x / world_pixels * 360 - 180
+        cols = np.floor((lons - west) / transform.a).astype(np.int64)
+        col_valid = (cols >= 0) & (cols < width)
+        cols = np.clip(cols, 0, width - 1)
+        
+        for ty in range(y0, y1 + 1):
+            pixel_y = np.arange(ty * TILE_SIZE, (ty + 1) * TILE_SIZE) + 0.5
+            lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pixel_y / world_pixels))))
+            rows = np.floor((lats - north) / transform.e).astype(np.int64)
+            row_valid = (rows >= 0) & (rows < height)
+            rows = np.clip(rows, 0, height - 1)
+            inside = row_valid[:, None] & col_valid[None, :]
+            
+            for name, (values, mask, _, vmax) in layers.items():
+                has_data = inside & mask[np.ix_(rows, cols)]
+                if not has_data.any():
+                    continue
+                
+                strip = values[np.ix_(rows, cols)]
+                steps = np.where(has_data, 1 + np.clip(strip / vmax * 254, 0, 254), 0).astype(np.uint8)
+                palette, transparency = palettes[name]
+                
+                for tx in range(x0, x1 + 1):
+                    start = (tx - x0) * TILE_SIZE
+                    if not has_data[:, start:start + TILE_SIZE].any():
+                        continue
+                    tile_path = os.path.join(tile_dir, name, str(zoom), str(tx))
+                    os.makedirs(tile_path, exist_ok=True)
+                    with open(os.path.join(tile_path, f"{ty}.png"), 'wb') as f:
+                        f.write(encode_png(steps[:, start:start + TILE_SIZE], palette, transparency))
+                    num_tiles += 1
+            
+            rows_done += 1
+            if progress is not None:
+                progress(rows_done / tile_rows)
+    
+    return num_tiles
+
+def prepare_access_tiles(tile_key, layers, transform, shape, progress=None):
+    """
+    Tiles of an analysis from disk, rendering them on first use.
+    
+    Tile sets are keyed by the analysis inputs. Only the coarse zoom levels (up to
+    TILE_PREVIEW_BUDGET tiles per layer) are rendered here, reporting progress to the
+    optional callback; a set is rendered into a temporary folder and published by
+    renaming it into place once complete, so sessions never see (or delete) a set another
+    session is still rendering. The finer levels, up to the index's target_zoom, are then
+    added in the background by extend_tile_set. Only the TILE_SETS_KEPT most recently
+    used sets are kept, except that sets used in the last TILE_KEEP_SECONDS or still being
+    extended are never dropped.
+    
+    Returns:
+    - Tile set index: dictionary with bounds, min_zoom, max_zoom (finest level rendered
+      so far), target_zoom and layers
+    """
+    tile_dir = os.path.join(TILE_DIR, tile_key)
+    index_path = os.path.join(tile_dir, "index.json")
+    rendered = False
+    
+    if not os.path.exists(index_path):
+        height, width = shape
+        bounds = (transform.c, transform.f + transform.e * height, transform.c + transform.a * width, transform.f)
+        min_zoom, target_zoom = tile_zoom_levels(bounds, abs(transform.a))
+        _, max_zoom = tile_zoom_levels(bounds, abs(transform.a), budget=TILE_PREVIEW_BUDGET)
+        
+        os.makedirs(TILE_DIR, exist_ok=True)
+        partial_dir = tempfile.mkdtemp(dir=TILE_DIR, prefix=".partial-")
+        try:
+            render_map_tiles(layers, transform, shape, partial_dir, min_zoom, max_zoom, progress)
+            index = {'bounds': bounds, 'min_zoom': min_zoom, 'max_zoom': max_zoom, 'target_zoom': target_zoom,
+                     'layers': list(layers)}
+            with open(os.path.join(partial_dir, "index.json"), 'w') as f:
+                json.dump(index, f)
+            # mkdtemp folders are private to the owner; tiles are served to everyone
+            os.chmod(partial_dir, 0o755)
+            try:
+                os.rename(partial_dir, tile_dir)
+            except OSError:
+                # Another session published the same set first
+                if not os.path.exists(index_path):
+                    raise
+        finally:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+        rendered = True
+    
+    os.utime(tile_dir)
+    with open(index_path) as f:
+        index = json.load(f)
+    
+    # Also picks up sets whose extension was interrupted (by a server restart)
+    if index['max_zoom'] < index.get('target_zoom', index['max_zoom']):
+        extensions = tile_extensions()
+        with extensions['lock']:
+            if tile_key not in extensions['running']:
+                extensions['running'].add(tile_key)
+                threading.Thread(target=extend_tile_set, args=(tile_key, layers, transform, shape), daemon=True).start()
+    
+    if rendered:
+        prune_tile_sets()
+    return index
+
+@st.cache_resource
+def tile_extensions():
+    """
+    Keys of the tile sets whose finer zoom levels are being rendered in the background,
+    shared across sessions (which run in threads, so hold the lock).
+    """
+    return {'running': set(), 'lock': threading.Lock()}
+
+def extend_tile_set(tile_key, layers, transform, shape):
+    """
+    Add the zoom levels of a published tile set up to its target_zoom, one level at a time.
+    
+    Each level is rendered into a temporary folder and its layer folders are renamed into
+    the set before the index is rewritten (and renamed into place) to include it, so maps
+    never ask for tiles of an unfinished level. Runs in a background thread, which keeps
+    the layer arrays until it is done.
+    """
+    tile_dir = os.path.join(TILE_DIR, tile_key)
+    index_path = os.path.join(tile_dir, "index.json")
+    
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+        
+        for zoom in range(index['max_zoom'] + 1, index['target_zoom'] + 1):
+            partial_dir = tempfile.mkdtemp(dir=TILE_DIR, prefix=".partial-")
+            try:
+                render_map_tiles(layers, transform, shape, partial_dir, zoom, zoom)
+                for name in os.listdir(partial_dir):
+                    level_dir = os.path.join(tile_dir, name, str(zoom))
+                    # Left behind by an extension that stopped before updating the index
+                    shutil.rmtree(level_dir, ignore_errors=True)
+                    os.makedirs(os.path.dirname(level_dir), exist_ok=True)
+                    os.rename(os.path.join(partial_dir, name, str(zoom)), level_dir)
+            finally:
+                shutil.rmtree(partial_dir, ignore_errors=True)
+            
+            index['max_zoom'] = zoom
+            with open(index_path + ".part", 'w') as f:
+                json.dump(index, f)
+            os.replace(index_path + ".part", index_path)
+    finally:
+        extensions = tile_extensions()
+        with extensions['lock']:
+            extensions['running'].discard(tile_key)
+
+def prune_tile_sets():
+    """
+    Drop the least recently used tile sets beyond TILE_SETS_KEPT, except those used in the
+    last TILE_KEEP_SECONDS and those still being extended
+    """
+    extensions = tile_extensions()
+    with extensions['lock']:
+        running = set(extensions['running'])
+    
+    tile_sets = []
+    for name in os.listdir(TILE_DIR):
+        if name.startswith(".partial-") or name in running:
+            continue
+        try:
+            tile_sets.append((os.path.getmtime(os.path.join(TILE_DIR, name)), name))
+        except FileNotFoundError:
+            continue
+    
+    recent = time.time() - TILE_KEEP_SECONDS
+    for modified, name in sorted(tile_sets)[:-TILE_SETS_KEPT]:
+        if modified <= recent:
+            shutil.rmtree(os.path.join(TILE_DIR, name), ignore_errors=True)
+
+def tile_map_html(tile_key, index, layer_labels, visible_layers, facilities_gdf, boundaries_gdf, height=600):
+    """
+    Leaflet map of a tile set with facility markers and boundary lines, loading only visible
+    tiles. While finer zoom levels are still being rendered, the page checks the index every
+    TILE_POLL_SECONDS and shows each level once it is published.
+    """
+    west, south, east, north = index['bounds']
+    target_zoom = index.get('target_zoom', index['max_zoom'])
+    overlays = {layer_labels[name]: f"{name}/{{z}}/{{x}}/{{y}}.png" for name in index['layers']}
+    facilities = [[round(lat, 6), round(lon, 6)] for lon, lat in zip(facilities_gdf.geometry.x, facilities_gdf.geometry.y)]
+    boundaries = boundaries_gdf.geometry.simplify(0.001).to_json()
+    
+    return f"""
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css"/>
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<div id="map" style="height: {height - 20}px; border-radius: 8px;"></div>
+<script>
+    var map = L.map('map', {{minZoom: {index['min_zoom']}, maxZoom: {target_zoom + 3}}});
+    var base = L.tileLayer('https://tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
+        attribution: '&copy; OpenStreetMap contributors', maxZoom: 19
+    }}).addTo(map);
+    // Tiles are served by the app itself, relative to the page the map is embedded in
+    var tileRoot = new URL('{TILE_URL}/{tile_key}/', document.baseURI).href;
+    var tileUrls = {json.dumps(overlays)};
+    var visible = {json.dumps([layer_labels[name] for name in visible_layers])};
+    var overlays = {{}};
+    var tileLayers = [];
+    for (var label in tileUrls) {{
+        // Tiles exist up to max zoom; finer zooms scale those up
+        var layer = L.tileLayer(tileRoot + tileUrls[label], {{
+            minZoom: {index['min_zoom']}, maxNativeZoom: {index['max_zoom']}, maxZoom: {target_zoom + 3},
+            opacity: 0.7, bounds: [[{south}, {west}], [{north}, {east}]], errorTileUrl: ''
+        }});
+        if (visible.indexOf(label) >= 0) layer.addTo(map);
+        overlays[label] = layer;
+        tileLayers.push(layer);
+    }}
+    // Finer zoom levels are published one at a time by the background rendering
+    var nativeZoom = {index['max_zoom']};
+    function checkZoomLevels() {{
+        fetch(tileRoot + 'index.json', {{cache: 'no-store'}}).then(function (response) {{
+            return response.json();
+        }}).then(function (latest) {{
+            if (latest.max_zoom > nativeZoom) {{
+                nativeZoom = latest.max_zoom;
+                tileLayers.forEach(function (layer) {{
+                    layer.options.maxNativeZoom = nativeZoom;
+                    layer.redraw();
+                }});
+            }}
+        }}).catch(function () {{}}).then(function () {{
+            if (nativeZoom < {target_zoom}) setTimeout(checkZoomLevels, {TILE_POLL_SECONDS * 1000});
+        }});
+    }}
+    if (nativeZoom < {target_zoom}) setTimeout(checkZoomLevels, {TILE_POLL_SECONDS * 1000});
+    overlays['Boundaries'] = L.geoJSON({boundaries}, {{
+        style: {{color: '#000000', weight: 0.8, opacity: 0.7, fill: false}}
+    }}).addTo(map);
+    overlays['Health Facilities'] = L.layerGroup({json.dumps(facilities)}.map(function (p) {{
+        return L.circleMarker(p, {{radius: 4, color: '#7f1d1d', weight: 1, fillColor: '#dc2626', fillOpacity: 0.9}});
+    }})).addTo(map);
+    L.control.layers({{'OpenStreetMap': base}}, overlays, {{collapsed: false}}).addTo(map);
+    map.fitBounds([[{south}, {west}], [{north}, {east}]]);
+</script>
+"""
+
 # Main app
 st.markdown("""
 <h1>
@@ -777,6 +1429,18 @@ with st.sidebar:
     )
     
     st.info(f" Analyzing access within **{radius_km} km** radius")
+    
+    st.markdown("---")
+    
+    # Map display
+    st.markdown("### Map Display")
+    
+    map_view = st.radio(
+        "Map View",
+        MAP_VIEWS,
+        help="Interactive maps load only the tiles in view and can be zoomed to full resolution; "
+             "static maps are also included in the PDF download"
+    )
 
 # Main content
 col1, col2 = st.columns([2, 1])
@@ -811,22 +1475,23 @@ with col1:
                 status_text.text(f"Downloading {year} population data...")
                 progress_bar.progress(30)
                 
-                pop_data, pop_url = download_worldpop_data(country_code, year)
-                
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    pop_path = os.path.join(tmpdir, "population.tif")
-                    with open(pop_path, "wb") as f:
-                        f.write(pop_data)
-                    
-                    # Load population raster
-                    with rasterio.open(pop_path) as src:
-                        pop_array = src.read(1)
-                        pop_transform = src.transform
-                        pop_crs = src.crs
-                        pop_nodata = src.nodata if src.nodata is not None else -99999
-                        pop_bounds = src.bounds
+                population_raster = read_population_raster(country_code, year)
+                pop_array = population_raster['array']
+                pop_transform = population_raster['transform']
+                pop_crs = population_raster['crs']
+                pop_nodata = population_raster['nodata']
+                pop_bounds = population_raster['bounds']
+                pop_url = population_raster['url']
+                pop_sketch = population_raster['sketch']
                 
                 st.success(f" Population data loaded ({year})")
+                if pop_sketch['count'] > 0:
+                    st.caption(
+                        f"{pop_sketch['count']:,} populated pixels; people per pixel: "
+                        f"median {sketch_quantile(pop_sketch, 0.5):,.1f}, "
+                        f"98th percentile {sketch_quantile(pop_sketch, 0.98):,.1f}, "
+                        f"maximum {pop_sketch['max']:,.1f}"
+                    )
                 progress_bar.progress(40)
                 
                 # Step 3: Process facilities
@@ -926,101 +1591,108 @@ with col1:
                 access_within = (distance_raster <= radius_km * 1000) & (pop_array != pop_nodata) & (~np.isnan(pop_array)) & (pop_array > 0)
                 access_beyond = (distance_raster > radius_km * 1000) & (pop_array != pop_nodata) & (~np.isnan(pop_array)) & (pop_array > 0)
                 
-                pop_within_array = np.where(access_within, pop_array, np.nan)
-                pop_beyond_array = np.where(access_beyond, pop_array, np.nan)
-                
-                # Map 1: Population within radius
-                st.markdown(f"### Population Within {radius_km} km of Health Facilities")
+                # The maps show sum-preserving overview grids sized to the figure rather than
+                # every pixel; cells without population stay blank
+                factor = overview_factor(pop_array.shape)
+                
+                # Pixel distributions for the interactive tiles come out of the same pass
+                within_sketch = new_quantile_sketch() if map_view == "Interactive (tiles)" else None
+                beyond_sketch = new_quantile_sketch() if map_view == "Interactive (tiles)" else None
+                pop_within_display = overview_sums(pop_array, access_within, factor, sketch=within_sketch)
+                pop_beyond_display = overview_sums(pop_array, access_beyond, factor, sketch=beyond_sketch)
+                pop_within_display[pop_within_display <= 0] = np.nan
+                pop_beyond_display[pop_beyond_display <= 0] = np.nan
+                
+                overview_rows, overview_cols = pop_within_display.shape
+                overview_extent = [
+                    pop_transform.c,
+                    pop_transform.c + overview_cols * factor * pop_transform.a,
+                    pop_transform.f + overview_rows * factor * pop_transform.e,
+                    pop_transform.f,
+                ]
+                if factor == 1:
+                    colorbar_label = 'Population Density'
+                else:
+                    colorbar_label = f'Population per {factor * abs(pop_transform.a) * 111.32:.1f} km cell'
+                
+                cmap_within = LinearSegmentedColormap.from_list('access_within', ACCESS_WITHIN_COLORS)
+                cmap_beyond = LinearSegmentedColormap.from_list('access_beyond', ACCESS_BEYOND_COLORS)
+                
+                if map_view == "Interactive (tiles)":
+                    # Tile sets are keyed by everything that changes the rasters
+                    tile_hash = hashlib.sha1(f"{pop_url}|{radius_km}".encode())
+                    tile_hash.update(np.ascontiguousarray(
+                        np.column_stack([facilities_gdf.geometry.x, facilities_gdf.geometry.y])
+                    ).tobytes())
+                    tile_key = tile_hash.hexdigest()[:16]
+                    
+                    cmap_population = LinearSegmentedColormap.from_list('population', POPULATION_COLORS)
+                    
+                    # Colour limits (98th percentile of populated pixels) from the sketches;
+                    # all populated pixels are exactly the within and beyond pixels together
+                    tile_layers = {}
+                    for name, mask, cmap, sketch in [
+                        ('population', access_within | access_beyond, cmap_population,
+                         merge_quantile_sketches(within_sketch, beyond_sketch)),
+                        ('within', access_within, cmap_within, within_sketch),
+                        ('beyond', access_beyond, cmap_beyond, beyond_sketch),
+                    ]:
+                        if sketch['count'] > 0:
+                            tile_layers[name] = (pop_array, mask, cmap, sketch_quantile(sketch, 0.98))
+                    
+                    # Coarse zoom levels are rendered now, finer ones in the background
+                    tile_progress = st.empty()
+                    tile_index = prepare_access_tiles(
+                        tile_key, tile_layers, pop_transform, pop_array.shape,
+                        progress=lambda done: tile_progress.progress(done, text="Rendering map tiles...")
+                    )
+                    tile_progress.empty()
+                    
+                    layer_labels = {
+                        'population': "Population",
+                        'within': f"Within {radius_km} km",
+                        'beyond': f"Beyond {radius_km} km",
+                    }
+                    components.html(
+                        tile_map_html(tile_key, tile_index, layer_labels, ['within', 'beyond'],
+                                      facilities_gdf.to_crs("EPSG:4326"), admin_boundaries.to_crs("EPSG:4326")),
+                        height=620
+                    )
+                    st.caption("Zoom in for full resolution; use the layer control to switch between population layers. "
+                               "Static maps are included in the PDF download below.")
+                    if tile_index['max_zoom'] < tile_index.get('target_zoom', tile_index['max_zoom']):
+                        st.caption("Finer zoom levels are still being rendered and appear on the map as they finish.")
                 
-                fig1, ax1 = plt.subplots(1, 1, figsize=(12, 10), facecolor='white')
-                ax1.set_facecolor('white')
+                # Cap colours at the 98th percentile of the grid cells for better visualization
+                vmax_within, vmax_beyond = [
+                    sketch_quantile(update_quantile_sketch(new_quantile_sketch(), display[np.isfinite(display)]), 0.98)
+                    for display in (pop_within_display, pop_beyond_display)
+                ]
                 
-                # Plot admin boundaries
                 admin_boundaries_plot = admin_boundaries.to_crs("EPSG:4326")
-                admin_boundaries_plot.boundary.plot(ax=ax1, edgecolor='black', linewidth=0.5, alpha=0.7)
-                
-                # Plot population within radius
-                from matplotlib.colors import LinearSegmentedColormap
-                colors_within = ['#e0f2fe', '#bae6fd', '#7dd3fc', '#38bdf8', '#0ea5e9', '#0284c7', '#0369a1']
-                cmap_within = LinearSegmentedColormap.from_list('access_within', colors_within)
-                
-                # Only show areas with population > 0
-                pop_within_display = np.where(pop_within_array > 0, pop_within_array, np.nan)
-                
-                if np.nansum(pop_within_display) > 0:
-                    im1 = ax1.imshow(
-                        pop_within_display,
-                        extent=[pop_bounds.left, pop_bounds.right, pop_bounds.bottom, pop_bounds.top],
-                        cmap=cmap_within,
-                        alpha=0.7,
-                        interpolation='bilinear',
-                        vmin=0,
-                        vmax=np.nanpercentile(pop_within_display, 98)  # Cap at 98th percentile for better visualization
-                    )
-                    plt.colorbar(im1, ax=ax1, label='Population Density', shrink=0.7)
-                
-                # Plot facilities
                 facilities_gdf_plot = facilities_gdf.to_crs("EPSG:4326")
-                facilities_gdf_plot.plot(ax=ax1, color='#dc2626', markersize=30, marker='^', 
-                                        edgecolor='#7f1d1d', linewidth=0.8, label='Health Facilities', zorder=5)
-                
-                ax1.set_title(
-                    f"{country} - Population with Access to Health Services\nWithin {radius_km} km Radius ({year})",
-                    fontweight='bold', fontsize=13, color='black', pad=15
-                )
-                ax1.set_xlabel('Longitude', fontsize=10, color='black')
-                ax1.set_ylabel('Latitude', fontsize=10, color='black')
-                ax1.legend(loc='upper right', framealpha=0.9, edgecolor='black')
-                ax1.tick_params(colors='black', labelsize=9)
-                ax1.grid(True, alpha=0.2, linestyle='--', color='gray')
-                
-                plt.tight_layout()
-                st.pyplot(fig1)
-                
-                # Map 2: Population beyond radius
-                st.markdown(f"### Population Beyond {radius_km} km from Health Facilities")
                 
-                fig2, ax2 = plt.subplots(1, 1, figsize=(12, 10), facecolor='white')
-                ax2.set_facecolor('white')
-                
-                # Plot admin boundaries
-                admin_boundaries_plot.boundary.plot(ax=ax2, edgecolor='black', linewidth=0.5, alpha=0.7)
-                
-                # Plot population beyond radius
-                colors_beyond = ['#fef2f2', '#fecaca', '#fca5a5', '#f87171', '#ef4444', '#dc2626', '#b91c1c']
-                cmap_beyond = LinearSegmentedColormap.from_list('access_beyond', colors_beyond)
-                
-                # Only show areas with population > 0
-                pop_beyond_display = np.where(pop_beyond_array > 0, pop_beyond_array, np.nan)
-                
-                if np.nansum(pop_beyond_display) > 0:
-                    im2 = ax2.imshow(
-                        pop_beyond_display,
-                        extent=[pop_bounds.left, pop_bounds.right, pop_bounds.bottom, pop_bounds.top],
-                        cmap=cmap_beyond,
-                        alpha=0.7,
-                        interpolation='bilinear',
-                        vmin=0,
-                        vmax=np.nanpercentile(pop_beyond_display, 98)  # Cap at 98th percentile
+                if map_view == "Static":
+                    # Drawn straight from the overview grids; matplotlib is only used for the
+                    # PDF versions below, which need vector boundaries, markers and text
+                    overview_transform = rasterio.transform.from_origin(
+                        pop_transform.c, pop_transform.f, pop_transform.a * factor, -pop_transform.e * factor
                     )
-                    plt.colorbar(im2, ax=ax2, label='Population Density', shrink=0.7)
-                
-                # Plot facilities
-                facilities_gdf_plot.plot(ax=ax2, color='#16a34a', markersize=30, marker='^',
-                                        edgecolor='#14532d', linewidth=0.8, label='Health Facilities', zorder=5)
-                
-                ax2.set_title(
-                    f"{country} - Population without Access to Health Services\nBeyond {radius_km} km Radius ({year})",
-                    fontweight='bold', fontsize=13, color='black', pad=15
-                )
-                ax2.set_xlabel('Longitude', fontsize=10, color='black')
-                ax2.set_ylabel('Latitude', fontsize=10, color='black')
-                ax2.legend(loc='upper right', framealpha=0.9, edgecolor='black')
-                ax2.tick_params(colors='black', labelsize=9)
-                ax2.grid(True, alpha=0.2, linestyle='--', color='gray')
-                
-                plt.tight_layout()
-                st.pyplot(fig2)
+                    for title, display, colors, vmax, marker_colors in [
+                        (f"### Population Within {radius_km} km of Health Facilities",
+                         pop_within_display, ACCESS_WITHIN_COLORS, vmax_within, ('#dc2626', '#7f1d1d')),
+                        (f"### Population Beyond {radius_km} km from Health Facilities",
+                         pop_beyond_display, ACCESS_BEYOND_COLORS, vmax_beyond, ('#16a34a', '#14532d')),
+                    ]:
+                        st.markdown(title)
+                        st.image(render_raster_map(
+                            display, overview_transform, colors, vmax or 1,
+                            admin_boundaries_plot, facilities_gdf_plot, marker_colors
+                        ))
+                        if vmax is not None:
+                            st.markdown(legend_html(colors, vmax, colorbar_label), unsafe_allow_html=True)
+                    st.caption(f"▲ Health facilities ({len(facilities_gdf_plot)}). "
+                               f"Map PDFs with coordinates and legends are in the download below.")
                 
                 # Download section
                 st.markdown("##  Download Results")
@@ -1074,6 +1746,8 @@ with col1:
                             'Parameter': ['Country', 'Country Code', 'Year', 'Access Radius (km)', 
                                         'Total Population', 'Population Within Access', 'Population Beyond Access',
                                         '% Within Access', '% Beyond Access', 'Number of Facilities',
+                                        'Populated Pixels', 'Median Population per Pixel',
+                                        '98th Percentile Population per Pixel',
                                         'Admin Level', 'Analysis Date', 'Tool Version'],
                             'Value': [country, country_code, year, radius_km,
                                     f"{overall_stats['total_pop']:,.0f}",
@@ -1082,6 +1756,9 @@ with col1:
                                     f"{overall_stats['pct_within']:.2f}%",
                                     f"{overall_stats['pct_beyond']:.2f}%",
                                     len(facilities_gdf),
+                                    f"{pop_sketch['count']:,}",
+                                    f"{sketch_quantile(pop_sketch, 0.5) or 0:,.2f}",
+                                    f"{sketch_quantile(pop_sketch, 0.98) or 0:,.2f}",
                                     admin_level,
                                     datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
                                     'Access to Care Analysis v1.0']
@@ -1101,20 +1778,17 @@ with col1:
                 # PDF maps download
                 st.markdown("### Download Maps")
                 
-                pdf_buffer = BytesIO()
-                with PdfPages(pdf_buffer) as pdf:
-                    pdf.savefig(fig1, dpi=300, bbox_inches='tight', facecolor='white')
-                    pdf.savefig(fig2, dpi=300, bbox_inches='tight', facecolor='white')
-                
-                pdf_buffer.seek(0)
+                pdf_maps = [
+                    (pop_within_display, cmap_within, vmax_within, ('#dc2626', '#7f1d1d'),
+                     f"{country} - Population with Access to Health Services\nWithin {radius_km} km Radius ({year})"),
+                    (pop_beyond_display, cmap_beyond, vmax_beyond, ('#16a34a', '#14532d'),
+                     f"{country} - Population without Access to Health Services\nBeyond {radius_km} km Radius ({year})"),
+                ]
+                pdf_file_name = f"access_maps_{country_code}_{year}_{radius_km}km.pdf"
                 
-                st.download_button(
-                    label=" Download Maps (PDF)",
-                    data=pdf_buffer,
-                    file_name=f"access_maps_{country_code}_{year}_{radius_km}km.pdf",
-                    mime="application/pdf",
-                    use_container_width=True
-                )
+                # Drawn only when asked for
+                maps_pdf_download(pdf_maps, overview_extent, colorbar_label,
+                                  admin_boundaries_plot, facilities_gdf_plot, pdf_file_name)
                 
             except Exception as e:
                 st.error(f"❌ Error during analysis: {str(e)}")
@@ -1293,6 +1967,7 @@ with col2:
         - Uses chunked processing
         - Memory efficient
         - Latitude-adjusted distances
+        - Interactive maps load only the tiles in view (rendered once per analysis)
         """)
 
 # Footer